@@ -0,0 +1,183 @@
+# Benchmark suite over the songs in ../music/
+#   parse            :: vgmparse.Parser throughput in MB/s and commands/s
+#   load_vgm         :: time to build frames from VGM with record.py::load_vgm
+#   load_bin         :: time to load frames from .sn76489.bin with record.py::load_sn76489_bin
+#   render_model     :: realtime factor of the Python model, see sn76489.py
+#   record_rtl       :: realtime factor of play_and_record_wav in RTL simulation for a MAX_TIME slice
+#   record_gates     ::                        ---- // ----        gate level simulation, needs gate_level_netlist.v
+#
+# How to run this script from command line:
+#
+# python bench.py
+#
+# Results are written to bench_results.json, store them as a baseline and compare later runs against it:
+#
+# cp bench_results.json bench_baseline.json
+# COMPARE=bench_baseline.json python bench.py
+#
+# Comparison fails if any metric got worse by more than TOLERANCE (default 0.1 == 10%).
+# BENCHES selects benchmarks (comma separated), RECORD_VGM the song and MAX_TIME the slice recorded in simulation.
+#
+
+import contextlib
+import glob
+import io
+import json
+import os
+import shutil
+import subprocess
+import time
+
+import vgmparse
+import record
+import sn76489
+
+MUSIC_DIR = os.environ.get("MUSIC_DIR", "../music")
+RESULTS_FILE = os.environ.get("RESULTS", "bench_results.json")
+COMPARE = os.environ.get("COMPARE", "")
+RECORD_VGM = os.environ.get("RECORD_VGM", "../music/MISSION76496.bbc50hz.vgm")
+
+ALL_BENCHES = ["parse", "load_vgm", "load_bin", "render_model", "record_rtl", "record_gates"]
+BENCHES = os.environ.get("BENCHES", ",".join(ALL_BENCHES)).split(",")
+
+REPEATS = 5
+try:
+    REPEATS = int(os.environ.get("REPEATS", REPEATS))
+except:
+    pass
+
+MAX_TIME = 5
+try:
+    MAX_TIME = int(os.environ.get("MAX_TIME", MAX_TIME))
+except:
+    pass
+
+TOLERANCE = 0.1
+try:
+    TOLERANCE = float(os.environ.get("TOLERANCE", TOLERANCE))
+except:
+    pass
+
+# metrics where smaller is better, the rest are throughputs or realtime factors
+LOWER_IS_BETTER = ["seconds"]
+
+def best_time(function, repeats=REPEATS):
+    best = float('inf')
+    for n in range(repeats):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()): # loaders are chatty
+            function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def songs(patterns=["*.vgm", "*.vgz"]):
+    return sorted(filename for pattern in patterns for filename in glob.glob(os.path.join(MUSIC_DIR, pattern)))
+
+def bench_parse():
+    results = {}
+    for filename in songs():
+        data = open(filename, mode="rb").read()
+        try:
+            parser = vgmparse.Parser(data, lazy=True)
+            seconds = best_time(parser.parse_commands)
+        except Exception as e:
+            print(f"{os.path.basename(filename):40s} skipped: {e!r}")
+            continue
+        results[os.path.basename(filename)] = {
+            'seconds': seconds,
+            'mb_per_s': len(data) / seconds / 1e6,
+            'commands_per_s': len(parser.command_list) / seconds,
+        }
+    return results
+
+def bench_load_vgm():
+    results = {}
+    for filename in songs():
+        try:
+            results[os.path.basename(filename)] = {'seconds': best_time(lambda: record.load_vgm(filename))}
+        except Exception as e:
+            print(f"{os.path.basename(filename):40s} skipped: {e!r}")
+    return results
+
+def bench_load_bin():
+    return {os.path.basename(filename): {'seconds': best_time(lambda: record.load_sn76489_bin(filename))}
+            for filename in songs(["*.sn76489.bin"])}
+
+def bench_render_model():
+    with contextlib.redirect_stdout(io.StringIO()):
+        music, playback_rate, clock_rate = record.load_vgm(RECORD_VGM)
+    seconds = best_time(lambda: sn76489.render(music, playback_rate, clock_rate, max_time=MAX_TIME), repeats=1)
+    return {os.path.basename(RECORD_VGM): {'seconds': seconds, 'realtime_factor': MAX_TIME / seconds}}
+
+def bench_record(gates=False):
+    # runs play_and_record_wav in the simulator and picks the realtime factor from its profile
+    if not shutil.which("iverilog"):
+        print("skipped: iverilog is not installed")
+        return {}
+    if gates and not os.path.exists("gate_level_netlist.v"):
+        print("skipped: gate_level_netlist.v is missing")
+        return {}
+    profile_file = f"{record.output_basename(RECORD_VGM)}.profile.json"
+    if os.path.exists(profile_file):
+        os.remove(profile_file)
+    env = dict(os.environ, MODULE="record", VGM=RECORD_VGM, MAX_TIME=str(MAX_TIME), GATES="yes" if gates else "no",
+               COCOTB_RESULTS_FILE="results.bench.xml")
+    process = subprocess.run(["make"], env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if process.returncode != 0 or not os.path.exists(profile_file):
+        print(process.stdout[-2000:])
+        raise RuntimeError("recording failed")
+    profile = json.load(open(profile_file))
+    return {os.path.basename(RECORD_VGM): {'seconds': profile['wall_seconds'], 'realtime_factor': profile['realtime_factor']}}
+
+BENCHMARKS = {
+    'parse':        bench_parse,
+    'load_vgm':     bench_load_vgm,
+    'load_bin':     bench_load_bin,
+    'render_model': bench_render_model,
+    'record_rtl':   lambda: bench_record(gates=False),
+    'record_gates': lambda: bench_record(gates=True),
+}
+
+def flatten(results):
+    return {f"{bench}/{song}/{metric}": value
+            for bench, songs in results.items() if bench in BENCHMARKS
+            for song, metrics in songs.items()
+            for metric, value in metrics.items()}
+
+def compare(results, baseline):
+    # returns the list of metrics that got worse than baseline by more than TOLERANCE
+    current, previous = flatten(results), flatten(baseline)
+    regressions = []
+    for key in sorted(current.keys() & previous.keys()):
+        ratio = current[key] / previous[key] if previous[key] else float('inf')
+        if key.rsplit("/", 1)[-1] in LOWER_IS_BETTER:
+            worse = ratio > 1 + TOLERANCE
+        else:
+            worse = ratio < 1 - TOLERANCE
+        print(f"{key:70s} {previous[key]:14.4f} -> {current[key]:14.4f} {ratio:7.2f}x", "REGRESSION" if worse else "")
+        if worse:
+            regressions.append(key)
+    return regressions
+
+if __name__ == "__main__":
+    results = {'info': {'time': time.strftime("%Y-%m-%d %H:%M:%S"), 'max_time': MAX_TIME, 'record_vgm': RECORD_VGM}}
+    for bench in BENCHES:
+        print(f"--- {bench} ---")
+        try:
+            results[bench] = BENCHMARKS[bench]()
+        except Exception as e:
+            # the rest of the suite still runs and its results are saved, failed benchmark is left out of them
+            print(f"skipped: {bench} failed with {e!r}")
+            continue
+        for song, metrics in results[bench].items():
+            print(f"{song:40s}", " ".join(f"{metric}: {value:.4f}" for metric, value in metrics.items()))
+
+    with open(RESULTS_FILE, "w") as f:
+        json.dump(results, f, indent=2)
+    print("results ->", RESULTS_FILE)
+
+    if COMPARE:
+        print(f"--- compare against {COMPARE} ---")
+        regressions = compare(results, json.load(open(COMPARE)))
+        print(f"{len(regressions)} regressions beyond {TOLERANCE*100:.0f}%")
+        exit(1 if regressions else 0)
@@ -0,0 +1,73 @@
+# Micro-benchmark of VGM command decoding in vgmparse.py over the files in ../music/
+#
+# How to run this script from command line:
+#
+# python bench_vgmparse.py
+#
+# To compare against the original parser of the repository (or any other version), point BASELINE to its vgmparse.py:
+#
+# git show $(git rev-list --max-parents=0 HEAD):test/vgmparse.py > /tmp/vgmparse_baseline.py
+# BASELINE=/tmp/vgmparse_baseline.py python bench_vgmparse.py
+#
+# Both parsers are compared on the same work, construction of an eager Parser that decodes all commands into
+# command_list ('parser ms'), the original parser has no lazy mode and decodes in its constructor.
+#
+
+import glob
+import importlib.util
+import os
+import time
+
+import vgmparse
+
+MUSIC_DIR = os.environ.get("MUSIC_DIR", "../music")
+BASELINE = os.environ.get("BASELINE", "")
+
+REPEATS = 5
+try:
+    REPEATS = int(os.environ.get("REPEATS", REPEATS))
+except:
+    pass
+
+def load_module(filename, name):
+    spec = importlib.util.spec_from_file_location(name, filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def best_time(function, repeats=REPEATS):
+    best = float('inf')
+    for n in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bench_file(module, data):
+    timings = {'parser': best_time(lambda: module.Parser(data))}
+    parser = module.Parser(data)
+    if hasattr(parser, 'parse_command_table'):
+        timings['table'] = best_time(parser.parse_command_table)
+    return timings, len(parser.command_list)
+
+if __name__ == "__main__":
+    baseline = load_module(BASELINE, "vgmparse_baseline") if BASELINE else None
+
+    print(f"{'file':40s} {'size':>8s} {'commands':>9s} {'parser ms':>9s} {'Mcmd/s':>7s} {'table ms':>9s}" +
+          (f" {'base ms':>9s} {'speedup':>8s}" if baseline else ""))
+    for filename in sorted(glob.glob(os.path.join(MUSIC_DIR, "*.vg[mz]"))):
+        data = open(filename, mode="rb").read()
+        try:
+            timings, commands = bench_file(vgmparse, data)
+        except Exception as e:
+            print(f"{os.path.basename(filename):40s} skipped: {e!r}")
+            continue
+        line = f"{os.path.basename(filename):40s} {len(data):8d} {commands:9d} " + \
+               f"{timings['parser']*1e3:9.2f} {commands/timings['parser']/1e6:7.2f} {timings.get('table', 0)*1e3:9.2f}"
+        if baseline:
+            try:
+                base_timings, base_commands = bench_file(baseline, data)
+                line += f" {base_timings['parser']*1e3:9.2f} {base_timings['parser']/timings['parser']:7.1f}x"
+            except Exception as e:
+                line += f" baseline failed: {e!r}"
+        print(line)
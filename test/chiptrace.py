@@ -0,0 +1,123 @@
+# Trace of the internal chip state for test.py and record.py
+#
+# Signal handles are resolved once, every call appends a fixed-size binary record into a preallocated buffer,
+# records are written to the trace file in chunks and formatted into text only when the trace is rendered.
+#
+# How to render a trace from command line:
+#
+# python chiptrace.py ../output/MISSION76496.bbc50hz.trace.bin
+#
+
+import sys
+import numpy as np
+import cocotb
+
+RECORD = np.dtype([
+    ('cycle',           '<u8'),
+    ('valid',           'u1'),     # 0 if internal state could not be read, e.g. in gate level simulation
+    ('write_enabled',   'u1'),
+    ('ui_in',           'u1'),
+    ('latch',           'u1'),
+    ('compare',         '<u2', 3),
+    ('counter',         '<u2', 3),
+    ('out',             'u1', 3),
+    ('reset_lfsr',      'u1'),
+    ('white_noise',     'u1'),
+    ('noise_control',   'u1'),
+    ('noise_counter',   'u1'),
+    ('trigger',         'u1'),
+    ('trigger_edge',    'u1'),
+    ('lfsr',            '<u2'),
+    ('uo_out',          'u1'),
+])
+
+class ChipTrace:
+    # Callable with the same signature as the old print_chip_state(dut), can be passed as `log` to write_program()
+    def __init__(self, dut, filename=None, cycle_in_nanoseconds=1, chunk_size=4096):
+        self.dut = dut
+        self.cycle_in_nanoseconds = cycle_in_nanoseconds
+        self.buffer = np.zeros(chunk_size, dtype=RECORD)
+        self.count = 0
+        self.file = open(filename, mode="wb") if filename else None
+        try:
+            internal = dut.tt_um_rejunity_sn76489_uut
+            tone = [internal.tone[i].gen for i in range(3)]
+            noise = internal.noise[0].gen
+            self.internal = [internal.latch_control_reg] + \
+                [gen.compare for gen in tone] + [gen.counter for gen in tone] + [gen.out for gen in tone] + \
+                [noise.reset_lfsr, noise.is_white_noise, noise.control, noise.counter,
+                 noise.trigger, noise.trigger_edge, noise.lfsr]
+        except AttributeError:
+            self.internal = None # gate level netlist
+
+    def __call__(self, dut=None):
+        if self.count == len(self.buffer):
+            self.flush()
+        record = self.buffer[self.count]
+        record['cycle'] = int(cocotb.utils.get_sim_time("ns") // self.cycle_in_nanoseconds)
+        try:
+            record['write_enabled'] = int(self.dut.uio_in.value) & 1 == 0
+            record['ui_in'] = int(self.dut.ui_in.value)
+            record['uo_out'] = int(self.dut.uo_out.value)
+            values = [int(handle.value) for handle in self.internal]
+            record['latch'] = values[0]
+            record['compare'] = values[1:4]
+            record['counter'] = values[4:7]
+            record['out'] = values[7:10]
+            (record['reset_lfsr'], record['white_noise'], record['noise_control'], record['noise_counter'],
+             record['trigger'], record['trigger_edge'], record['lfsr']) = values[10:17]
+            record['valid'] = 1
+        except (ValueError, TypeError):
+            record['valid'] = 0 # undefined values right after the start or no access to the internals
+        self.count += 1
+        return record
+
+    def flush(self):
+        if self.file:
+            self.buffer[:self.count].tofile(self.file)
+            self.file.flush()
+        self.count = 0
+
+    def close(self):
+        self.flush()
+        if self.file:
+            self.file.close()
+
+def format_record(record):
+    if not record['valid']:
+        return f"{int(record['cycle']):8d} {int(record['ui_in']):08b} > {int(record['uo_out']):08b}"
+    tones = " ".join(f"{int(record['compare'][i]):4d} {int(record['counter'][i]):4d} " + ("|#|" if record['out'][i] else "|-|")
+                     for i in range(3))
+    return " ".join([
+        f"{int(record['cycle']):8d}",
+        "W" if record['write_enabled'] else " ",
+        f"{int(record['ui_in']):08b}", ">||",
+        f"{int(record['latch']):1d}", "!",
+        tones,
+        "R" if record['reset_lfsr'] else " ",
+        "w" if record['white_noise'] else "p",
+        ["16", "32", "64", "T3"][record['noise_control'] & 3],
+        f"{int(record['noise_counter']):3d}",
+        f"{int(record['trigger']):1d}",
+        ">" if record['trigger_edge'] else " ",
+        f"{int(record['lfsr']):015b}", ">>",
+        f"{int(record['uo_out']) >> 1:3d}",
+        "@" if record['uo_out'] & 1 else "."])
+
+def read_trace(filename):
+    return np.fromfile(filename, dtype=RECORD)
+
+_printers = {}
+def print_chip_state(dut, cycle_in_nanoseconds=1):
+    # formats the current chip state right away, handles are still resolved only once per dut
+    if id(dut) not in _printers:
+        _printers[id(dut)] = ChipTrace(dut, cycle_in_nanoseconds=cycle_in_nanoseconds, chunk_size=1)
+    printer = _printers[id(dut)]
+    printer.cycle_in_nanoseconds = cycle_in_nanoseconds
+    print(format_record(printer()))
+    printer.count = 0
+
+if __name__ == "__main__":
+    for filename in sys.argv[1:]:
+        for record in read_trace(filename):
+            print(format_record(record))
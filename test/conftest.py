@@ -0,0 +1,6 @@
+# Unit tests of the pure Python modules run with pytest without a simulator:
+#
+# python -m pytest -q
+#
+# Modules with cocotb tests run inside the simulator only, see README.md
+collect_ignore = ["test.py", "test_model.py", "record.py", "record_segments.py"]
@@ -0,0 +1,157 @@
+# Noise sequences of the LFSR in src/noise.v for all tap variants listed there
+#
+# Output of the LFSR depends only on its state, so the whole sequence from the reset state is computed once per
+# variant and kept as a packed bit array, white noise repeats after 2^15-1 shifts (57337 for SMS),
+# periodic noise after LFSR_BITS.
+# Any stretch of the output is then a slice of the table and the state after `k` shifts is found either
+# by its position in the table or, for states outside of it, by GF(2) matrix power in O(log k).
+#
+#   noise = LFSR.variant('bbc')
+#   noise.jump(noise.reset_state, 1_000_000, white=True)    # state after a million shifts
+#   noise.output(state, 48, white=True)                     # next 48 output bits (lfsr[0]) as uint8 array
+
+import numpy as np
+
+# name: (LFSR_BITS, LFSR_TAP0, LFSR_TAP1), SEE: src/noise.v
+VARIANTS = {
+    'bbc':   (15, 0, 1),    # SG-1000, OMV, SC-3000H, BBC Micro and Colecovision, used by this chip
+    'sms':   (16, 0, 3),    # SMS (1 and 2), Genesis and Game Gear
+    'tandy': (15, 0, 4),    # Tandy 1000
+}
+
+def parity(x):
+    return bin(x).count("1") & 1
+
+class LFSR:
+    _variants = {}
+
+    @classmethod
+    def variant(cls, name):
+        # tables are shared by all users of the same variant
+        if name not in cls._variants:
+            cls._variants[name] = cls(*VARIANTS[name])
+        return cls._variants[name]
+
+    def __init__(self, bits=15, tap0=0, tap1=1):
+        self.bits = bits
+        self.tap0 = tap0
+        self.tap1 = tap1
+        self.mask = (1 << bits) - 1
+        self.reset_state = 1 << (bits-1)
+        self._tables = {}
+        self._powers = {}
+
+    def step(self, state, white=True):
+        # single shift, same as the lfsr register of src/noise.v on trigger_edge
+        feedback = (state >> self.tap0) & 1
+        if white:
+            feedback ^= (state >> self.tap1) & 1
+        return (feedback << (self.bits-1)) | (state >> 1)
+
+    # Sequence tables ##########################################################
+
+    def table(self, white=True):
+        # returns (packed output bits from the reset state over one period, period, position of every state or -1)
+        if white not in self._tables:
+            if white:
+                bits = self._white_bits((1 << self.bits) + self.bits - 1)
+            else:
+                bits = ((self.reset_state >> np.arange(self.bits)) & 1).astype(np.uint8)
+                bits = np.concatenate([bits, bits[:self.bits-1]]) # rotates
+            # state after m shifts holds the output bits m..m+LFSR_BITS-1
+            states = np.lib.stride_tricks.sliding_window_view(bits, self.bits) @ (1 << np.arange(self.bits))
+            repeats = np.flatnonzero(states[1:] == states[0])
+            period = int(repeats[0]) + 1 if len(repeats) else len(states)
+            position = np.full(1 << self.bits, -1, dtype=np.int32)
+            position[states[:period]] = np.arange(period, dtype=np.int32)
+            self._tables[white] = (np.packbits(bits[:period], bitorder='little'), period, position)
+        return self._tables[white]
+
+    def _white_bits(self, length):
+        # x[m + bits] = x[m + tap0] ^ x[m + tap1], evaluated (bits - tap1) bits at a time
+        x = np.zeros(length + self.bits, dtype=np.uint8)
+        x[:self.bits] = (self.reset_state >> np.arange(self.bits)) & 1
+        chunk = self.bits - max(self.tap0, self.tap1)
+        for m in range(0, length, chunk):
+            n = min(chunk, length - m)
+            x[m+self.bits:m+self.bits+n] = x[m+self.tap0:m+self.tap0+n] ^ x[m+self.tap1:m+self.tap1+n]
+        return x[:length]
+
+    def sequence(self, white=True):
+        # unpacked output bits from the reset state over one period
+        packed, period, _ = self.table(white)
+        return np.unpackbits(packed, count=period, bitorder='little')
+
+    def period(self, white=True):
+        return self.table(white)[1]
+
+    def position(self, state, white=True):
+        # number of shifts from the reset state to `state`, -1 if the state is not in the sequence
+        return int(self.table(white)[2][state & self.mask])
+
+    def output(self, state, count, white=True):
+        # output bits (lfsr[0]) of `state` followed by the next count-1 shifts as uint8 array
+        position = self.position(state, white)
+        if position < 0: # e.g. all zeros, stuck forever
+            return np.array([(self.jump_matrix(state, k, white) & 1) for k in range(count)], dtype=np.uint8)
+        sequence = self._unpacked(white)
+        return sequence[(position + np.arange(count, dtype=np.int64)) % len(sequence)]
+
+    def _unpacked(self, white):
+        key = ('unpacked', white)
+        if key not in self._tables:
+            self._tables[key] = self.sequence(white)
+        return self._tables[key]
+
+    # Jump ahead ###############################################################
+
+    def matrix(self, white=True):
+        # single shift as a GF(2) matrix, row i is the mask of state bits XORed into the bit i of the next state
+        rows = [1 << (i + 1) for i in range(self.bits - 1)]
+        rows.append((1 << self.tap0) | ((1 << self.tap1) if white else 0))
+        return rows
+
+    @staticmethod
+    def multiply(a, b):
+        # GF(2) matrix product a·b of matrices given as row masks
+        result = []
+        for row in a:
+            product = 0
+            j = 0
+            while row:
+                if row & 1:
+                    product ^= b[j]
+                row >>= 1
+                j += 1
+            result.append(product)
+        return result
+
+    def apply(self, rows, state):
+        return sum(parity(row & state) << i for i, row in enumerate(rows))
+
+    def power(self, n, white=True):
+        # matrix of 2^n shifts, squared from the previous power and cached
+        key = (n, white)
+        if key not in self._powers:
+            previous = self.matrix(white) if n == 0 else self.power(n-1, white)
+            self._powers[key] = previous if n == 0 else self.multiply(previous, previous)
+        return self._powers[key]
+
+    def jump(self, state, shifts, white=True):
+        # state after `shifts` shifts in O(log shifts), table lookup if the state is part of the sequence
+        position = self.position(state, white)
+        if position < 0:
+            return self.jump_matrix(state, shifts, white)
+        sequence = self._unpacked(white)
+        position = (position + shifts) % len(sequence)
+        return int(sequence[(position + np.arange(self.bits)) % len(sequence)] @ (1 << np.arange(self.bits)))
+
+    def jump_matrix(self, state, shifts, white=True):
+        # same as jump(), always by matrix power, e.g. to validate the tables
+        n = 0
+        while shifts:
+            if shifts & 1:
+                state = self.apply(self.power(n, white), state)
+            shifts >>= 1
+            n += 1
+        return state
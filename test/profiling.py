@@ -0,0 +1,69 @@
+# Per-phase wall time and realtime factor of a recording, saved as JSON next to the output WAVs
+#
+# Time is attributed with laps: lap(phase) adds the wall time since the previous lap to the given phase,
+# thus phases do not nest and instrumenting the inner loop costs a single perf_counter() call per lap.
+#
+#   profile = Profile(vgm=filename)
+#   ... load song ...
+#   profile.lap("parse")
+#   await ClockCycles(dut.clk, n)
+#   profile.lap("wait")
+#   profile.count(awaits=1)
+#   profile.save("../output/song.profile.json", simulated_seconds)
+
+import json
+import time
+
+class Profile:
+    def __init__(self, **info):
+        self.info = info
+        self.phases = {}
+        self.counts = {}
+        self.timeline = []
+        self.start = time.perf_counter()
+        self.last = self.start
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + (now - self.last)
+        self.last = now
+
+    def count(self, **counts):
+        for name, value in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def sample(self, frame, simulated_seconds):
+        # point of the timeline, realtime factor since the previous point
+        wall_seconds = time.perf_counter() - self.start
+        previous = self.timeline[-1] if self.timeline else {'simulated_seconds': 0.0, 'wall_seconds': 0.0}
+        self.timeline.append({
+            'frame': frame,
+            'simulated_seconds': simulated_seconds,
+            'wall_seconds': wall_seconds,
+            'realtime_factor': (simulated_seconds - previous['simulated_seconds']) /
+                               max(wall_seconds - previous['wall_seconds'], 1e-9),
+        })
+
+    def report(self, simulated_seconds):
+        wall_seconds = time.perf_counter() - self.start
+        audio_seconds = max(simulated_seconds, 1e-9)
+        return {
+            **self.info,
+            'simulated_seconds': simulated_seconds,
+            'wall_seconds': wall_seconds,
+            'realtime_factor': simulated_seconds / wall_seconds,
+            'phases': self.phases,
+            'phases_share': {phase: seconds / wall_seconds for phase, seconds in self.phases.items()},
+            'counts': self.counts,
+            'per_audio_second': {name: value / audio_seconds for name, value in self.counts.items()},
+            'timeline': self.timeline,
+        }
+
+    def save(self, filename, simulated_seconds):
+        report = self.report(simulated_seconds)
+        with open(filename, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"simulated {simulated_seconds:.2f} sec in {report['wall_seconds']:.2f} sec, " +
+              f"realtime factor {report['realtime_factor']:.4f} ->", filename)
+        print("  " + ", ".join(f"{phase}: {seconds:.2f} sec" for phase, seconds in self.phases.items()))
+        return report
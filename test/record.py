@@ -2,18 +2,61 @@
 #
 # make MODULE=record VGM=../music/MISSION76496.bbc50hz.vgm MAX_TIME=10
 #
+# Add CAPTURE=hdl to take the samples inside the simulator, Python then wakes up only for register writes:
+#
+# make MODULE=record VGM=../music/MISSION76496.bbc50hz.vgm MAX_TIME=10 CAPTURE=hdl
+#
+# CAPTURE=full takes the output on every clock cycle of the chip instead and decimates it with a band-limited
+# low-pass filter (see resample.py), tones above a few kHz do not alias and the PDM output on uio_out[7]
+# is recorded as an additional .pdm.wav stem. SAMPLING_RATE selects 44100 (default), 48000 or 96000 Hz:
+#
+# make MODULE=record VGM=../music/MISSION76496.bbc50hz.vgm MAX_TIME=10 CAPTURE=full SAMPLING_RATE=48000
+#
+# Wall time per phase (parse, write, wait, read, wav, ...), realtime factor and the number of GPI calls and awaits
+# per second of audio are saved into ../output/<song>.profile.json next to the WAVs.
+#
+# VGM can also point to a .sn76489.bin file, OUTPUT_DIR changes the directory of the WAVs (../output by default).
+# To render many songs at once in parallel, see record_batch.py
+#
+# Waveforms are not dumped while recording, add DUMP=all|top|outputs to dump a window (in milliseconds) into tb.vcd:
+#
+# make MODULE=record VGM=../music/MISSION76496.bbc50hz.vgm MAX_TIME=10 DUMP=outputs DUMP_START=4000 DUMP_STOP=4050
+#
+# To split the song into segments simulated in parallel, see record_segments.py
+#
+# VGMs that are not quantized into 50/60 Hz frames (short 0x7n waits, waits of any length) are played from
+# a list of register writes timestamped in VGM samples, SCHEDULE=events forces that for any VGM:
+#
+# make MODULE=record VGM=../music/SonicTheHedgehog-BridgeZone.vgm SCHEDULE=events
+#
+# START_TIME (seconds) or START_FRAME skips the beginning of the song, e.g. to listen to the last 10 seconds only:
+#
+# make MODULE=record VGM=../music/MISSION76496.bbc50hz.vgm START_TIME=184
+#
+# Chip state at the start is computed by the Python model (sn76489.py) from the register writes alone, counters
+# included, and deposited into RTL, simulation starts right at START_TIME. MAX_TIME stays a position in the song.
+#
 
 import cocotb
 from cocotb.clock import Clock
-from cocotb.triggers import RisingEdge, FallingEdge, Timer, ClockCycles
+from cocotb.triggers import RisingEdge, FallingEdge, Timer, ClockCycles, ReadOnly, NextTimeStep
 
 import os
+import hashlib
+import itertools
+import inspect
 import numpy as np
-from scipy.io.wavfile import write
+from wavwriter import WavWriter
+from resample import Decimator
+from registers import write_program
+from chiptrace import ChipTrace
+from profiling import Profile
 
 # https://github.com/cdodd/vgmparse
 # sudo pip install -e git+https://github.com/cdodd/vgmparse.git#egg=vgmparse
 import vgmparse
+import sn76489
+import sn76489bin
 
 VGM_FILENAME = "../music/MISSION76496.bbc50hz.vgm"
 VGM_FILENAME = os.environ.get("VGM", VGM_FILENAME)
@@ -25,199 +68,670 @@ try:
 except:
     pass
 
+# LOOP=N plays the song N times, repeats start from the loop point in the VGM header (the whole song if it has none),
+# LOOP=-1 repeats the loop section until MAX_TIME
 LOOP = 0
 try:
     LOOP = int(os.environ.get("LOOP", LOOP))
 except:
     pass
 
-cycle_in_nanoseconds = 0
-def print_chip_state(dut):
-    try:
-        internal = dut.tt_um_rejunity_sn76489_uut
-        print(
-            '{:8d}'.format(int(cocotb.utils.get_sim_time("ns") // cycle_in_nanoseconds)),
-            "W" if dut.uio_in.value & 1 == 0 else " ",
-            dut.ui_in.value, ">||",
-            '{:1d}'.format(int(internal.latch_control_reg.value)), "!",
-            '{:4d}'.format(int(internal.tone[0].gen.compare.value)),
-            '{:4d}'.format(int(internal.tone[0].gen.counter.value)),
-                        "|#|" if internal.tone[0].gen.out == 1 else "|-|", # "|",
-            '{:4d}'.format(int(internal.tone[1].gen.compare.value)),
-            '{:4d}'.format(int(internal.tone[1].gen.counter.value)),
-                        "|#|" if internal.tone[1].gen.out == 1 else "|-|",  #"|",
-            '{:4d}'.format(int(internal.tone[2].gen.compare.value)),
-            '{:4d}'.format(int(internal.tone[2].gen.counter.value)),
-                        "|#|" if internal.tone[2].gen.out == 1 else "|-|",  #"!",
-            "R" if internal.noise[0].gen.reset_lfsr == 1 else " ",
-            "w" if internal.noise[0].gen.is_white_noise == 1 else "p",
-            ["16", "32", "64", "T3"][internal.noise[0].gen.control.value & 3],
-            '{:3d}'.format(int(internal.noise[0].gen.counter)),
-            internal.noise[0].gen.trigger.value,
-            ">" if internal.noise[0].gen.trigger_edge == 1 else " ",
-            internal.noise[0].gen.lfsr.value, ">>",
-            '{:3d}'.format(int(dut.uo_out.value >> 1)),
-                        "@" if dut.uo_out[0].value == 1 else ".")
-    except:
-       print(dut.ui_in.value, ">", dut.uo_out.value)
+# WAVs, traces and profiles are written into OUTPUT_DIR
+OUTPUT_DIR = os.environ.get("OUTPUT_DIR", "../output")
+
+# Decoded and validated frames are cached next to ../output/, CACHE=0 disables the cache
+CACHE_DIR = os.environ.get("CACHE_DIR", "../cache")
+CACHE = os.environ.get("CACHE", "1") not in ["0", "no", ""]
 
+# CAPTURE=hdl takes samples inside the simulator (see capture_enable in tb.v) instead of waking Python for every sample,
+# CAPTURE=full takes samples inside the simulator on every clock cycle and decimates them to SAMPLING_RATE
+CAPTURE = os.environ.get("CAPTURE", "python")
+
+SAMPLING_RATE = 44100
+try:
+    SAMPLING_RATE = int(os.environ.get("SAMPLING_RATE", SAMPLING_RATE))
+except:
+    pass
+
+# TRACE=1 traces the chip state before every group of register writes, TRACE=2 also after every register write.
+# Trace is written in binary to ../output/<song>.trace.bin, render it with: python chiptrace.py ../output/<song>.trace.bin
+TRACE = 0
+try:
+    TRACE = int(os.environ.get("TRACE", TRACE))
+except:
+    pass
+
+# SEGMENTS=N SEGMENT=k simulates only the k-th of N segments of the song, used by record_segments.py.
+# Chip state at the start of the segment is restored from a checkpoint computed by the Python model (sn76489.py),
+# state at the end of the segment is checked against the checkpoint the next segment starts from.
+SEGMENTS = 0
+SEGMENT = 0
+try:
+    SEGMENTS = int(os.environ.get("SEGMENTS", SEGMENTS))
+    SEGMENT = int(os.environ.get("SEGMENT", SEGMENT))
+except:
+    pass
+
+# SCHEDULE=auto plays frame-quantized VGMs frame by frame (cached, validated against .bin, seekable and loopable)
+# and the rest from timestamped register writes, SCHEDULE=events always plays timestamped register writes
+SCHEDULE = os.environ.get("SCHEDULE", "auto")
+
+# START_TIME=seconds or START_FRAME=n starts recording from the given frame of the song, see seek in play_and_record_wav
+START_TIME = 0.0
+START_FRAME = -1
+try:
+    START_TIME = float(os.environ.get("START_TIME", START_TIME))
+except:
+    pass
+try:
+    START_FRAME = int(os.environ.get("START_FRAME", START_FRAME))
+except:
+    pass
 
 def load_sn76489_bin(filename, verbose=False):
-    f = open(filename, mode="rb")
-    data = f.read()
-    f.close()
-    print(filename, len(data))
-    print("header size: ", data[0], "playback rate: ", data[1], "packets: ", data[2] + 256*data[3], "minutes: ", data[4], "seconds: ", data[5]);
-    playback_rate = data[1]
-    packets = data[2] + 256*data[3]
-    offset = data[0] + 1
-    print("titles size:", data[offset], "title: ", data[offset + 1: offset + 1 + data[offset]])
-    offset += data[offset] + 1
-    print("author size:", data[offset], "author: ", data[offset + 1: offset + 1 + data[offset]])
-    offset += data[offset] + 1
-
-    # cut the header
-    data = data[offset:len(data)]
-    offset = 0
-
-    jagged = []
-    for i in range(packets):
-        jagged.append(data[offset+1:offset+1+data[offset]])
-        if verbose: print("packet", i, "size:", data[offset], "data: ", jagged[-1])
-        offset += data[offset] + 1
-    if verbose: print(packets, offset, len(data), int(data[offset]), int(data[-1]))
-    assert data[offset    ] == 0x00
-    assert data[offset + 1] == 0xff
-
-    assert packets == len(jagged)
-    return jagged, playback_rate
-
-def load_vgm(filename, verbose=False):
-    f = open(filename, mode="rb")
-    data = f.read()
-    f.close()
-    vgm_data = vgmparse.Parser(data)
+    # packets are memoryviews into the memory mapped file, indexed by frame, see sn76489bin.py
+    packets = sn76489bin.SN76489Bin(filename)
+    print(packets)
+    if verbose:
+        for i, packet in enumerate(packets):
+            print("packet", i, "size:", len(packet), "data: ", bytes(packet))
+    return packets, packets.playback_rate
+
+# .sn76489.bin files carry no clock, songs are assumed to be from BBC Micro
+SN76489_BIN_CLOCK = 4_000_000
+
+def output_basename(vgm_filename):
+    return os.path.join(OUTPUT_DIR, os.path.basename(vgm_filename).rstrip('.vgm'))
+
+# see https://vgmrips.net/wiki/VGM_Specification#Commands for command descriptions
+VGM_SAMPLE_RATE = 44100
+CMD_SN76489 = 0x50
+CMD_WAIT_PERIOD = 0x61
+CMD_WAIT_60 = 0x62
+CMD_WAIT_50 = 0x63
+CMD_EOF = 0x66
+WAIT_PERIOD_60 = 735 # samples to wait at 60Hz with 44100 sampling rate
+WAIT_PERIOD_50 = 882 # samples to wait at 50Hz with 44100 sampling rate
+
+def wait_command(playback_rate):
+    # setup commands according to playback rate
+    if (playback_rate == 50):
+        return CMD_WAIT_50, WAIT_PERIOD_50
+    elif (playback_rate == 60):
+        return CMD_WAIT_60, WAIT_PERIOD_60
+    else:
+        return -1, 44100 // playback_rate
+
+def open_vgm(filename):
+    vgm_data = vgmparse.Parser(filename, lazy=True) # memory maps the file
     print(vgm_data.metadata)
+    return vgm_data
+
+def iter_vgm(filename, verbose=False, vgm_data=None):
+    # Returns a generator of frames that decodes VGM commands lazily,
+    # the number of frames is estimated from the VGM header.
+    # VGM file (also an already opened `vgm_data`) is closed once all frames are decoded
+    vgm_data = vgm_data if vgm_data is not None else open_vgm(filename)
 
     playback_rate = vgm_data.metadata['rate']
     clock_rate = vgm_data.metadata['sn76489_clock']
     seconds = vgm_data.metadata['total_samples'] / 44100
     frames = int(seconds * playback_rate)
+    CMD_WAIT, WAIT_PERIOD = wait_command(playback_rate)
+
+    def jagged():
+        frame = []
+        total_wait = 0
+        frame_count = 0
+        with vgm_data: # unmapped once the song is decoded or the generator is closed
+            for i, item in enumerate(vgm_data.iter_commands()):
+                cmd = int.from_bytes(item['command'], 'little')
+                data = int.from_bytes(item['data'], 'little') if item['data'] != None else 0
+                if (cmd == CMD_SN76489):
+                    frame.append(data)
+                elif cmd == CMD_WAIT or cmd == CMD_WAIT_PERIOD or cmd == CMD_EOF:
+                    total_wait += (WAIT_PERIOD if cmd == CMD_WAIT else data)
+
+                    yield bytes(frame)
+                    frame_count += 1
+                    frame = []
+
+                    if cmd == CMD_WAIT_PERIOD:
+                        assert data >= WAIT_PERIOD
+                        assert data % WAIT_PERIOD == 0
+                        for n in range(data // WAIT_PERIOD - 1):
+                            yield bytes([])
+                            frame_count += 1
+                else:
+                    raise AssertionError("Unsupported command by SN76489")
+        assert frame == []
+        assert WAIT_PERIOD*(frame_count-1) >= total_wait or total_wait <= WAIT_PERIOD*frame_count
+
+    return jagged(), playback_rate, clock_rate, frames
+
+def load_vgm(filename, verbose=False, vgm_data=None):
+    # Builds all frames at once from the columnar command table of the VGM,
+    # writes and waits are filtered with vectorized operations.
+    # Command table of an already opened `vgm_data` is reused, see load_vgm_events()
+    if vgm_data is None:
+        with open_vgm(filename) as vgm_data:
+            return load_vgm(filename, verbose, vgm_data)
 
-    # see https://vgmrips.net/wiki/VGM_Specification#Commands for command descriptions
-    CMD_SN76489 = 0x50
-    CMD_WAIT_PERIOD = 0x61
-    CMD_WAIT_60 = 0x62
-    CMD_WAIT_50 = 0x63
-    CMD_EOF = 0x66
-    WAIT_PERIOD_60 = 735 # samples to wait at 60Hz with 44100 sampling rate
-    WAIT_PERIOD_50 = 882 # samples to wait at 50Hz with 44100 sampling rate
+    playback_rate = vgm_data.metadata['rate']
+    clock_rate = vgm_data.metadata['sn76489_clock']
+    CMD_WAIT, WAIT_PERIOD = wait_command(playback_rate)
+
+    table = vgm_data.command_table or vgm_data.parse_command_table()
+    buffer = np.frombuffer(table['buffer'], dtype=np.uint8)
+    cmd = np.frombuffer(table['opcode'], dtype=np.uint8).astype(np.int32)
+    offset = np.frombuffer(table['offset'], dtype=np.uint32)
+
+    is_write = cmd == CMD_SN76489
+    is_wait_period = cmd == CMD_WAIT_PERIOD
+    is_wait = (cmd == CMD_WAIT) | is_wait_period | (cmd == CMD_EOF)
+    if not np.all(is_write | is_wait):
+        raise AssertionError("Unsupported command by SN76489")
+
+    wait = np.where(cmd == CMD_WAIT, WAIT_PERIOD, 0)
+    wait_offset = offset[is_wait_period]
+    wait[is_wait_period] = buffer[wait_offset] | (buffer[wait_offset + 1].astype(np.int32) << 8)
+    assert np.all(wait[is_wait_period] >= WAIT_PERIOD)
+    assert np.all(wait[is_wait_period] % WAIT_PERIOD == 0)
+
+    # every wait ends the current frame, long waits are followed by empty frames
+    frames_ended = np.where(is_wait_period, wait // WAIT_PERIOD, is_wait)
+    frame_index = np.cumsum(frames_ended) - frames_ended
+    frame_count = int(frames_ended.sum())
+    write_frame = frame_index[is_write]
+    assert np.all(write_frame < frame_count)
+
+    writes = buffer[offset[is_write]].tobytes()
+    bounds = np.searchsorted(write_frame, np.arange(frame_count + 1)).tolist()
+    jagged = [writes[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    total_wait = int(wait.sum())
+    assert WAIT_PERIOD*(len(jagged)-1) >= total_wait or total_wait <= WAIT_PERIOD*len(jagged)
+    return jagged, playback_rate, clock_rate
 
-    # setup commands according to playback rate
-    if (playback_rate == 50):
-        CMD_WAIT = CMD_WAIT_50
-        WAIT_PERIOD = WAIT_PERIOD_50
-    elif (playback_rate == 60):
-        CMD_WAIT = CMD_WAIT_60
-        WAIT_PERIOD = WAIT_PERIOD_60
-    else:
-        CMD_WAIT = -1
-        WAIT_PERIOD = 44100 // playback_rate
-
-    jagged = []
-    frame = []
-    total_wait = 0
-    for i, item in enumerate(vgm_data.command_list):
-        cmd = int.from_bytes(item['command'], 'little')
-        data = int.from_bytes(item['data'], 'little') if item['data'] != None else 0
-        if (cmd == CMD_SN76489):
-            frame.append(data)
-        elif cmd == CMD_WAIT or cmd == CMD_WAIT_PERIOD or cmd == CMD_EOF:
-            total_wait += (WAIT_PERIOD if cmd == CMD_WAIT else data)
-
-            jagged.append(bytes(frame))
-            frame = []
-
-            if cmd == CMD_WAIT_PERIOD:
-                assert data >= WAIT_PERIOD
-                assert data % WAIT_PERIOD == 0
-                for n in range(data // WAIT_PERIOD - 1):
-                    jagged.append(bytes([]))
+def vgm_loop_frame(vgm_filename):
+    # First frame of the loop section according to the VGM header, 0 (the whole song) if VGM does not loop.
+    # Frames are WAIT_PERIOD samples long, see load_vgm()
+    with vgmparse.Parser(vgm_filename, lazy=True) as vgm_data:
+        metadata = vgm_data.metadata
+    if not metadata.get('loop_offset') or not metadata.get('loop_samples'):
+        return 0
+    CMD_WAIT, WAIT_PERIOD = wait_command(metadata['rate'])
+    return (metadata['total_samples'] - metadata['loop_samples']) // WAIT_PERIOD
+
+def loop_frames(music, loop_frame, repeats=-1):
+    # Plays the song, then its loop section (frames from `loop_frame` on) until the song was played `repeats` times,
+    # repeats forever if -1. Section is sized by the frames decoded on the first pass, not by the VGM header.
+    # Lists are repeated in place, lazily decoded frames of the loop section are kept by reference for the repeats.
+    n = 0
+    section = music if isinstance(music, list) else []
+    for frame in music:
+        if section is not music and n >= loop_frame:
+            section.append(frame)
+        yield frame
+        n += 1
+    start = loop_frame if section is music else 0
+    if start >= len(section):
+        return
+    played = 1
+    while repeats < 0 or played < repeats:
+        for i in range(start, len(section)):
+            yield section[i]
+        played += 1
+
+def load_vgm_events(filename, vgm_data=None):
+    # Register writes of the VGM timestamped in VGM samples (44100 Hz) without quantizing them into frames,
+    # any waits are accepted (0x61 of any length, 0x62, 0x63 and short 0x70..0x7F).
+    # Returns sample of every write, written bytes, sample where the song ends, playback and clock rate
+    # and whether the song can be played frame by frame as well, see frame_quantized().
+    # Command table stays in `vgm_data`, load_vgm() builds the frames from it without parsing the VGM again
+    if vgm_data is None:
+        with open_vgm(filename) as vgm_data:
+            return load_vgm_events(filename, vgm_data)
+
+    table = vgm_data.command_table or vgm_data.parse_command_table()
+    buffer = np.frombuffer(table['buffer'], dtype=np.uint8)
+    cmd = np.frombuffer(table['opcode'], dtype=np.uint8)
+    offset = np.frombuffer(table['offset'], dtype=np.uint32)
+    sample = np.frombuffer(table['sample'], dtype=np.uint64).astype(np.int64)
+
+    is_write = cmd == CMD_SN76489
+    is_wait = np.isin(cmd, [CMD_WAIT_PERIOD, CMD_WAIT_60, CMD_WAIT_50, CMD_EOF]) | ((cmd & 0xf0) == 0x70)
+    if not np.all(is_write | is_wait):
+        raise AssertionError("Unsupported command by SN76489")
+
+    # time after the last command
+    end_sample = int(sample[-1]) if len(sample) else 0
+    if len(cmd) and cmd[-1] != CMD_EOF:
+        end_sample += vgmparse.Parser.wait_table[int(cmd[-1])] if cmd[-1] != CMD_WAIT_PERIOD else \
+                      int(buffer[offset[-1]]) | (int(buffer[offset[-1] + 1]) << 8)
+    playback_rate = vgm_data.metadata['rate']
+    return sample[is_write], buffer[offset[is_write]].tobytes(), end_sample, \
+           playback_rate, vgm_data.metadata['sn76489_clock'], frame_quantized(cmd, sample, end_sample, playback_rate)
+
+def frame_quantized(cmd, sample, end_sample, playback_rate):
+    # True if iter_vgm() decodes the song: playback rate is known, waits are 0x61 or the frame wait of the playback
+    # rate and every wait (including the last one up to `end_sample`) lasts a whole number of frames
+    if playback_rate <= 0 or VGM_SAMPLE_RATE % playback_rate != 0:
+        return False
+    CMD_WAIT, WAIT_PERIOD = wait_command(playback_rate)
+    is_wait = (cmd != CMD_SN76489) & (cmd != CMD_EOF)
+    if not np.all(np.isin(cmd[is_wait], [CMD_WAIT, CMD_WAIT_PERIOD])):
+        return False
+    waits = np.diff(np.append(sample, end_sample))[is_wait]
+    return bool(np.all((waits >= WAIT_PERIOD) & (waits % WAIT_PERIOD == 0)))
+
+def vgm_frame_quantized(vgm_data):
+    # Same as frame_quantized() from a scan of the opcodes without building the command table,
+    # stops at the first wait that is not a whole number of frames
+    playback_rate = vgm_data.metadata['rate']
+    if playback_rate <= 0 or VGM_SAMPLE_RATE % playback_rate != 0:
+        return False
+    CMD_WAIT, WAIT_PERIOD = wait_command(playback_rate)
+    for command, wait in vgm_data.iter_opcodes():
+        if command == CMD_SN76489 or command == CMD_EOF:
+            continue
+        if (command != CMD_WAIT and command != CMD_WAIT_PERIOD) or wait < WAIT_PERIOD or wait % WAIT_PERIOD != 0:
+            return False
+    return True
+
+def frame_schedule(music, playback_rate, clock_rate, first=0):
+    # Frames as (index, cycle, writes) at the cycle of the chip where the frame starts, empty frames are skipped,
+    # thus the gaps between the writes are waited at once. Last entry without writes marks the end of the song.
+    index = first - 1
+    for index, frame in enumerate(music, start=first):
+        if len(frame) > 0:
+            yield index, sn76489.frame_cycle(index, playback_rate, clock_rate), frame
+    yield index + 1, sn76489.frame_cycle(index + 1, playback_rate, clock_rate), b''
+
+def event_schedule(samples, writes, end_sample, clock_rate):
+    # Timestamped writes as (index, cycle, writes), writes at the same VGM sample are grouped together.
+    # Cycles are computed from the absolute sample with the exact clock rate, so the song does not drift.
+    starts = np.flatnonzero(np.diff(samples, prepend=-1)).tolist() + [len(samples)]
+    cycles = (samples[starts[:-1]] * clock_rate) // (VGM_SAMPLE_RATE * 16)
+    for index, (start, end, cycle) in enumerate(zip(starts[:-1], starts[1:], cycles.tolist())):
+        yield index, cycle, writes[start:end]
+    yield len(starts) - 1, (end_sample * clock_rate) // (VGM_SAMPLE_RATE * 16), b''
+
+def check_against_bin(music, music_raw):
+    # Passes frames of the VGM through while comparing them against the packets from the .bin file
+    tail = []
+    n = 0
+    for packet_vgm in music:
+        if n < len(music_raw):
+            assert packet_vgm == music_raw[n]
         else:
-            raise AssertionError("Unsupported command by SN76489")
-    assert frame == []
-    assert WAIT_PERIOD*(len(jagged)-1) >= total_wait or total_wait <= WAIT_PERIOD*len(jagged)
+            tail.append(packet_vgm)
+        n += 1
+        yield packet_vgm
+
+    if n != len(music_raw):
+        cutoff = min(n, len(music_raw))
+        print(f'WARNING: packet count differs, VGM has {n} while BIN has {len(music_raw)}!!!')
+        print(tail[:-1])
+        print('---  tail of ^^^^^ VGM vs RAW BIN vvvvv  --- ')
+        print([bytes(packet) for packet in music_raw[cutoff:-1]])
+        non_empty_packets = list(filter(lambda packet: packet != b'', tail[:-1]))
+        assert len(non_empty_packets) == 0
+        non_empty_packets = list(filter(lambda packet: packet != b'', music_raw[cutoff:-1]))
+        assert len(non_empty_packets) == 0
+
+def raw_sn76489_filenames(vgm_filename):
+    return [vgm_filename.rstrip('.vgm') + ".sn76489.bin", vgm_filename.rstrip('.vgm') + ".bin"]
+
+def cache_filename(vgm_filename):
+    # Cache key is a hash of the song, its raw .bin (if any) that frames are validated against,
+    # and the code of the parser and loaders, so any change to them invalidates the cache
+    key = hashlib.sha1()
+    for filename in [vgm_filename] + raw_sn76489_filenames(vgm_filename):
+        if os.path.exists(filename):
+            with open(filename, mode="rb") as f:
+                key.update(f.read())
+    for module in [vgmparse, sn76489bin]:
+        with open(module.__file__, mode="rb") as f:
+            key.update(f.read())
+    for loader in [iter_vgm, load_vgm, load_sn76489_bin, check_against_bin]:
+        key.update(inspect.getsource(loader).encode())
+    return os.path.join(CACHE_DIR, f"{os.path.basename(vgm_filename)}.{key.hexdigest()[:16]}.npz")
+
+def load_cached_frames(vgm_filename):
+    # Returns frames, playback_rate and clock_rate or None, if song is not in the cache
+    filename = cache_filename(vgm_filename)
+    if not os.path.exists(filename):
+        return None
+    with np.load(filename) as cached:
+        lengths = cached['lengths']
+        data = cached['data'].tobytes()
+        playback_rate, clock_rate = cached['rates'].tolist()
+    bounds = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)]).tolist()
+    jagged = [data[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+    print("loaded cached frames from", filename)
     return jagged, playback_rate, clock_rate
 
+def save_cached_frames(vgm_filename, jagged, playback_rate, clock_rate):
+    # Frames are stored as packet lengths followed by all register writes back to back
+    filename = cache_filename(vgm_filename)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    temp_filename = filename + f".{os.getpid()}.tmp.npz" # segments might be recorded in parallel
+    np.savez(temp_filename,
+        lengths=np.array([len(frame) for frame in jagged], dtype=np.uint16),
+        data=np.frombuffer(b''.join(jagged), dtype=np.uint8),
+        rates=np.array([playback_rate, clock_rate], dtype=np.int64))
+    os.replace(temp_filename, filename) # partially written cache is never picked up
+    print("cached frames to", filename)
+
+def cache_frames(vgm_filename, music, playback_rate, clock_rate):
+    # Validates all frames and stores them in the cache before playing, thus the cache is written
+    # even if only the beginning of the song is recorded (MAX_TIME)
+    jagged = list(music)
+    save_cached_frames(vgm_filename, jagged, playback_rate, clock_rate)
+    return jagged
+
+def stem_handles(dut):
+    # Master output and the 4 channel volumes. Volumes are not accessible in the gate level netlist,
+    # only the master output is read then and the channel stems stay silent, same as capture_volumes in tb.v
+    try:
+        internal = dut.tt_um_rejunity_sn76489_uut
+        return [dut.uo_out] + [internal.chan[ch].attenuation.out for ch in range(4)]
+    except AttributeError:
+        return [dut.uo_out]
+
+class StemCapture:
+    # Captures the master output and the 4 channel volumes into a preallocated buffer of raw values.
+    # Signal handles are resolved once, scaling to int16 happens vectorized once the buffer fills up
+    # or on flush(), then the chunk is appended to the WAV files and the buffer is reused.
+    # Without `dut` samples come only from extend(), taken by tb.v (CAPTURE=hdl), no handles are resolved.
+    def __init__(self, dut, wave_files, sampling_rate, chunk_size):
+        self.handles = stem_handles(dut) if dut is not None else []
+        self.wav = [WavWriter(filename, sampling_rate) for filename in wave_files]
+        self.buffer = np.zeros((len(wave_files), chunk_size), dtype=np.uint16)
+        self.count = 0
+        self.total = 0
+
+    def sample(self):
+        if self.count == self.buffer.shape[1]:
+            self.flush()
+        self.buffer[:len(self.handles), self.count] = [int(handle.value) for handle in self.handles]
+        self.count += 1
+        self.total += 1
+
+    def extend(self, raw):
+        # appends a block of raw values of shape (5, n)
+        while raw.shape[1] > 0:
+            if self.count == self.buffer.shape[1]:
+                self.flush()
+            n = min(raw.shape[1], self.buffer.shape[1] - self.count)
+            self.buffer[:, self.count:self.count + n] = raw[:, :n]
+            self.count += n
+            self.total += n
+            raw = raw[:, n:]
+
+    def flush(self):
+        raw = self.buffer[:, :self.count].astype(np.int32)
+        raw[0] <<= 7 # master output is 8 bit, channels are 10 bit
+        assert raw.min(initial=0) >= 0
+        assert raw.max(initial=0) <= 32767
+        stems = np.clip(raw * 2 - 32767, -32767, 32767).astype(np.int16)
+        for wav, data in zip(self.wav, stems):
+            wav.write(data)
+            wav.flush()
+        self.count = 0
+
+    def close(self):
+        self.flush()
+        for wav in self.wav:
+            wav.close()
+
+class HDLCapture:
+    # Samples taken by tb.v inside the simulator, drained from the capture file after every wait
+    FILENAME = os.environ.get("CAPTURE_FILE", "capture.bin")
+
+    def __init__(self, dut, sampling_rate, clock_rate, pdm=False):
+        if os.path.exists(self.FILENAME):
+            os.remove(self.FILENAME)
+        self.dut = dut
+        self.file = None
+        self.pdm = pdm
+        self.pending = b''
+        dut.capture_rate.value = sampling_rate
+        dut.capture_clock.value = clock_rate
+        dut.capture_enable.value = 1
+
+    async def drain(self):
+        # returns raw values of shape (5, n) captured since the last call, (6, n) with the PDM output.
+        # tb.v flushes the capture file only when asked by toggling capture_flush. Samples of the current clock edge
+        # are written after Python resumes on it, they are read in ReadOnly once all of them are in the file, then
+        # the next time step is awaited, since signals can not be written in ReadOnly.
+        self.dut.capture_flush.value = int(self.dut.capture_flush.value) ^ 1
+        await ReadOnly()
+        raw = self.read()
+        await NextTimeStep()
+        return raw
+
+    def read(self):
+        if self.file is None and os.path.exists(self.FILENAME):
+            self.file = open(self.FILENAME, mode="rb")
+        data = self.pending + (self.file.read() if self.file else b'')
+        complete = len(data) - len(data) % 8
+        self.pending = data[complete:]
+        words = np.frombuffer(data[:complete], dtype='<u4').reshape(-1, 2)
+        return np.vstack([
+            words[:, 0] & 0xff,                 # uo_out
+            (words[:, 0] >>  8) & 0x3ff,        # chan[0].attenuation.out
+            (words[:, 0] >> 18) & 0x3ff,        # chan[1].attenuation.out
+            words[:, 1] & 0x3ff,                # chan[2].attenuation.out
+            (words[:, 1] >> 10) & 0x3ff,        # chan[3].attenuation.out
+        ] + ([
+            (words[:, 0] >> 28) & 1,            # uio_out[7]
+        ] if self.pdm else [])).astype(np.uint16)
+
+    async def close(self):
+        # returns the samples left since the last drain, tb.v reopens the capture file once enabled again
+        raw = await self.drain()
+        self.dut.capture_enable.value = 0
+        if self.file:
+            self.file.close()
+        return raw
+
+class DecimatedCapture:
+    # Captures raw values taken on every clock cycle (CAPTURE=full) and filters them down to the sampling rate.
+    # Same interface as StemCapture for extend(), chunks are filtered as they come, only the filter history is kept.
+    def __init__(self, wave_files, sampling_rate, clock_rate):
+        self.wav = [WavWriter(filename, sampling_rate) for filename in wave_files]
+        self.decimator = Decimator(clock_rate, sampling_rate, channels=len(wave_files))
+        self.total = 0
+
+    def extend(self, raw):
+        # appends a block of raw values of shape (6, n) as returned by HDLCapture.drain()
+        raw = raw.astype(np.float32)
+        raw[0] *= 1 << 7    # master output is 8 bit, channels are 10 bit
+        raw[5] *= 1 << 15   # average of the 1 bit PDM output matches the master output
+        self.write(self.decimator.process(raw))
+
+    def write(self, stems):
+        stems = np.clip(np.rint(stems * 2 - 32767), -32767, 32767).astype(np.int16)
+        for wav, data in zip(self.wav, stems):
+            wav.write(data)
+        self.total += stems.shape[1]
+
+    def flush(self):
+        for wav in self.wav:
+            wav.flush()
+
+    def close(self):
+        self.write(self.decimator.flush())
+        for wav in self.wav:
+            wav.close()
+
+class ChipState:
+    # Registers of RTL that make up the complete state of the chip, named as in SN76489.state() of sn76489.py.
+    # PWM accumulators are left out, they drive only uio_out which is not recorded.
+    def __init__(self, dut):
+        internal = dut.tt_um_rejunity_sn76489_uut
+        tone = [internal.tone[i].gen for i in range(3)]
+        noise = internal.noise[0].gen
+        self.registers = {
+            'clk_counter':       internal.clk_counter,
+            'control_attn':      [internal.control_attn[i] for i in range(4)],
+            'control_tone_freq': [internal.control_tone_freq[i] for i in range(3)],
+            'control_noise':     internal.control_noise[0],
+            'latch_control_reg': internal.latch_control_reg,
+            'restart_noise':     internal.restart_noise,
+            'tone_counter':      [gen.counter for gen in tone],
+            'tone_state':        [gen.state for gen in tone],
+            'noise_counter':     noise.counter,
+            'noise_trigger':     noise.signal_edge.previous_signal_state_0,
+            'lfsr':              noise.lfsr,
+        }
+        # differs from previous_signal_state_0 only right after reset
+        self.previous_signal_state_1 = noise.signal_edge.previous_signal_state_1
+
+    def read(self):
+        return {name: [int(h.value) for h in handle] if isinstance(handle, list) else int(handle.value)
+                for name, handle in self.registers.items()}
+
+    def write(self, state):
+        for name, handle in self.registers.items():
+            if isinstance(handle, list):
+                for h, value in zip(handle, state[name]):
+                    h.value = value
+            else:
+                handle.value = state[name]
+        self.previous_signal_state_1.value = state['noise_trigger']
+
+    def matches(self, state):
+        return self.read() == {name: state[name] for name in self.registers}
+
 @cocotb.test()
 async def play_and_record_wav(dut):
     max_time = MAX_TIME
     vgm_filename = VGM_FILENAME
-
-    music, playback_rate, clock_rate = load_vgm(vgm_filename)
-    if True: # test against bin files
+    profile = Profile(vgm=vgm_filename, simulator=cocotb.SIM_NAME, gates=os.environ.get("GATES", "no") == "yes",
+                      sel=1, capture=CAPTURE, sampling_rate=SAMPLING_RATE, segment=SEGMENT if SEGMENTS > 0 else None)
+
+    cached = load_cached_frames(vgm_filename) if CACHE and SCHEDULE != "events" and not vgm_filename.endswith(".bin") else None
+    events = None
+    if vgm_filename.endswith(".bin"):
+        # raw register writes per frame without VGM
+        music, playback_rate = load_sn76489_bin(vgm_filename)
+        clock_rate = SN76489_BIN_CLOCK
+        frames = len(music)
+    elif cached:
+        # cached frames were already validated, skip parsing and validation
+        music, playback_rate, clock_rate = cached
+        frames = len(music)
+    else:
+        vgm_data = open_vgm(vgm_filename)
+        if SCHEDULE != "events" and not CACHE and vgm_frame_quantized(vgm_data):
+            # VGM is decoded while playing, chip starts receiving register writes right away,
+            # iter_vgm() closes the file once the song is decoded
+            music, playback_rate, clock_rate, frames = iter_vgm(vgm_filename, vgm_data=vgm_data)
+        else:
+            with vgm_data:
+                events = load_vgm_events(vgm_filename, vgm_data=vgm_data)
+                samples, writes, end_sample, playback_rate, clock_rate, quantized = events
+                if SCHEDULE == "events" or not quantized:
+                    # writes or waits between the frames, play timestamped writes instead
+                    music = None
+                    if playback_rate <= 0:
+                        playback_rate = VGM_SAMPLE_RATE // WAIT_PERIOD_60 # not given by the VGM, frames are only reported
+                    frames = end_sample * playback_rate // VGM_SAMPLE_RATE
+                    print(f"playing {len(writes)} timestamped register writes")
+                else:
+                    # cache miss, frames are built from the command table parsed above and cached before playing,
+                    # see cache_frames()
+                    events = None
+                    music, playback_rate, clock_rate = load_vgm(vgm_filename, vgm_data=vgm_data)
+                    frames = len(music)
+    if music is None:
+        assert LOOP == 0 and SEGMENTS == 0 and START_TIME <= 0 and START_FRAME <= 0, \
+            "LOOP, SEGMENTS and START_TIME need a VGM quantized into frames"
+    elif not cached and not vgm_filename.endswith(".bin"): # test against bin files
         try:
-            raw_sn76489_filename = vgm_filename.rstrip('.vgm') + ".sn76489.bin"
+            raw_sn76489_filename = raw_sn76489_filenames(vgm_filename)[0]
             music_raw, playback_rate_raw = load_sn76489_bin(raw_sn76489_filename)
         except:
             try:
-                raw_sn76489_filename = vgm_filename.rstrip('.vgm') + ".bin"
+                raw_sn76489_filename = raw_sn76489_filenames(vgm_filename)[1]
                 music_raw, playback_rate_raw = load_sn76489_bin(raw_sn76489_filename)        
             except:
-                music_raw = music
+                music_raw = None
                 playback_rate_raw = playback_rate
 
         assert playback_rate_raw == playback_rate
-        for packet_vgm, packet_raw in zip(music, music_raw):
-            assert packet_vgm == packet_raw
-
-        if len(music) != len(music_raw):
-            cutoff = min(len(music), len(music_raw))
-            print(f'WARNING: packet count differs, VGM has {len(music)} while BIN has {len(music_raw)}!!!')
-            print(music[cutoff:-1])
-            print('---  tail of ^^^^^ VGM vs RAW BIN vvvvv  --- ')
-            print(music_raw[cutoff:-1])
-            non_empty_packets = list(filter(lambda packet: packet != b'', music[cutoff:-1]))
-            assert len(non_empty_packets) == 0
-            non_empty_packets = list(filter(lambda packet: packet != b'', music_raw[cutoff:-1]))
-            assert len(non_empty_packets) == 0
-
-    if LOOP > 0:
-        music = music * LOOP
-        music_raw = music_raw * LOOP
-
-    wave_file = [f"../output/{os.path.basename(vgm_filename).rstrip('.vgm')}.{ch}.wav" for ch in ["master", "tone0", "tone1", "tone2", "noise"]]
-    def get_sample(dut, channel):
-        # try:
-            if channel == 0:
-                return int(dut.uo_out.value) << 7
-            else:
-                return int(dut.tt_um_rejunity_sn76489_uut.chan[channel-1].attenuation.out.value)
-        # finally:
-            # return 0
+        if music_raw is not None:
+            music = check_against_bin(music, music_raw)
+        if CACHE:
+            music = cache_frames(vgm_filename, music, playback_rate, clock_rate)
+
+    if LOOP != 0:
+        loop_frame = vgm_loop_frame(vgm_filename) if not vgm_filename.endswith(".bin") else 0
+        if LOOP > 0:
+            # exact for frames in memory, lazily decoded VGMs are counted while playing, see loop_frames()
+            frames = len(music) if isinstance(music, (list, sn76489bin.SN76489Bin)) else frames
+            frames += max(frames - loop_frame, 0) * (LOOP - 1)
+        else:
+            assert max_time > 0, "LOOP=-1 needs MAX_TIME"
+            frames = int(max_time * playback_rate)
+        print(f"loop from frame {loop_frame}, {frames} frames in total")
+        music = loop_frames(music, loop_frame, LOOP)
+        if LOOP < 0:
+            # endless loop is cut right after MAX_TIME, so it can be listed for seek and segments below
+            music = itertools.islice(music, frames + 1)
+
+    first = 0
+    suffix = ""
+    checkpoint = None
+    if START_TIME > 0 or START_FRAME > 0:
+        assert SEGMENTS == 0, "segments are seeked by record_segments.py"
+        music = music if isinstance(music, sn76489bin.SN76489Bin) else list(music) # packets of .bin are indexed already
+        first = min(START_FRAME if START_FRAME > 0 else int(START_TIME * playback_rate), len(music))
+        checkpoint, = sn76489.checkpoints(music, playback_rate, clock_rate, [first])
+        music = music[first:]
+        print(f"seek to frame {first}, {first/playback_rate:.2f} sec")
+    elif SEGMENTS > 0:
+        assert CAPTURE == "hdl", "segments continue sample-accurate only with CAPTURE=hdl"
+        assert os.environ.get("GATES") != "yes", "segments restore internal registers of the chip, not available in gate level netlist"
+        music = list(music)
+        frames = len(music)
+        cycles = sn76489.sample_cycles(frames, playback_rate, clock_rate, max_time, SAMPLING_RATE)
+        boundaries = sn76489.segment_boundaries(sn76489.frames_to_render(music, playback_rate, clock_rate, cycles), SEGMENTS)
+        first, last = (boundaries[SEGMENT], boundaries[SEGMENT+1]) if SEGMENT + 1 < len(boundaries) else (boundaries[-1],) * 2
+        checkpoint, next_checkpoint = sn76489.checkpoints(music, playback_rate, clock_rate, [first, last])
+        music = music[first:last]
+        suffix = f".seg{SEGMENT:03d}"
+        print(f"segment {SEGMENT} of {SEGMENTS}: frames {first}..{last-1}")
+
+    stems = ["master", "tone0", "tone1", "tone2", "noise"] + (["pdm"] if CAPTURE == "full" else [])
+    wave_file = [f"{output_basename(vgm_filename)}.{ch}{suffix}.wav" for ch in stems]
     print(vgm_filename, "->", wave_file)
-    print(f"VGM playback rate: {playback_rate}, clock: {clock_rate}, frames: {len(music)}" )
-    print(f"VGM length: {len(music)/playback_rate:.2f} sec" )
-    print(f"This script will record {max_time if max_time > 0 else len(music)/playback_rate:.2f} sec" )
+    print(f"VGM playback rate: {playback_rate}, clock: {clock_rate}, frames: {frames}" )
+    print(f"VGM length: {frames/playback_rate:.2f} sec" )
+    print(f"This script will record {(max_time if max_time > 0 else frames/playback_rate) - (first/playback_rate if SEGMENTS == 0 else 0):.2f} sec" )
+    profile.info.update(frames=frames, playback_rate=playback_rate, clock_rate=clock_rate, start_frame=first)
+    profile.lap("parse")
     
     
     WRITE_ENABLED  = 0b11111_01_0 # SEL = 1 :: no clock div ; /WE = 0 :: writes enabled
     WRITE_DISABLED = 0b11111_01_1 # SEL = 1 :: no clock div ; /WE = 1 :: writes disabled
 
-    master_clock = clock_rate // 16 # using chip configuration without clock divider for faster recording
-    fps = playback_rate
-    cycles_per_frame = master_clock / fps
-    global cycle_in_nanoseconds
-    cycle_in_nanoseconds = 1e9 // master_clock
+    # using chip configuration without clock divider for faster recording, chip runs at clock_rate/16.
+    # Writes and samples are scheduled in cycles of the chip computed from the exact clock rate,
+    # clock period is rounded to picoseconds and only affects the simulated time, not the timing of the song.
+    master_clock = clock_rate // 16
+    cycle_in_picoseconds = round(1e12 * 16 / clock_rate)
+    cycle_in_nanoseconds = cycle_in_picoseconds / 1000
 
-    sampling_rate = 44100
-    nanoseconds_per_sample = 1e9 / sampling_rate
-    cycles_per_sample = nanoseconds_per_sample / cycle_in_nanoseconds
-    print("cycle in nanoseconds", cycle_in_nanoseconds, "cycles per frame:", cycles_per_frame, "cycles per wav sample", cycles_per_sample)
-    print("1 sec check:", fps * cycles_per_frame * cycle_in_nanoseconds / 1e9, "samples check", 1e9 / (cycles_per_sample * cycle_in_nanoseconds))
+    sampling_rate = SAMPLING_RATE
+    print("cycle in picoseconds", cycle_in_picoseconds, "cycles per frame:", clock_rate / 16 / playback_rate,
+          "cycles per wav sample", clock_rate / 16 / sampling_rate)
 
     dut._log.info("start")
-    clock = Clock(dut.clk, cycle_in_nanoseconds, units="ns")
+    clock = Clock(dut.clk, cycle_in_picoseconds, units="ps")
     cocotb.start_soon(clock.start())
 
     dut.ui_in.value = 0
@@ -227,47 +741,121 @@ async def play_and_record_wav(dut):
     dut.rst_n.value = 0
     await ClockCycles(dut.clk, 10)
     dut.rst_n.value = 1
-    print_chip_state(dut)
-
-    n = 0
-    samples = [[] for ch in wave_file]
-    for frame in music:
-        cur_time = cocotb.utils.get_sim_time(units="ns")
-        if max_time > 0 and max_time * 1e9 <= cur_time:
-            for ch, data in enumerate(samples):
-                write(wave_file[ch], sampling_rate, np.int16(data))
+    trace = ChipTrace(dut, f"{output_basename(vgm_filename)}{suffix}.trace.bin", cycle_in_nanoseconds) if TRACE > 0 else None
+    if trace: trace(dut)
+
+    cycle = sn76489.frame_cycle(first, playback_rate, clock_rate)
+    capture_rate = sampling_rate * 16 # samples per clock_rate/16 cycles, see capture_phase in tb.v
+    if checkpoint is not None and os.environ.get("GATES") == "yes":
+        # internal registers are not accessible in the gate level netlist, only the control registers
+        # are rebuilt by writes, counters and LFSR continue from reset and the phase of tones differs
+        dut._log.warning("gate level simulation: seek restores the control registers only")
+        await write_program(dut, sn76489.control_program(checkpoint), WRITE_ENABLED, WRITE_DISABLED)
+    elif checkpoint is not None:
+        # restore the chip state in the middle of a clock cycle, then clock it on from the checkpoint
+        await FallingEdge(dut.clk)
+        chip_state = ChipState(dut)
+        chip_state.write(checkpoint)
+    if checkpoint is not None:
+        dut.capture_phase.value = sn76489.capture_phase(cycle, capture_rate, clock_rate)
+    if SEGMENTS > 0:
+        max_time = -1 # segment already ends at MAX_TIME
+
+    # stems are appended to the WAV files once per second of the song
+    if CAPTURE == "full":
+        # sample on every clock cycle, the output is filtered and decimated as it is drained after every wait
+        capture = DecimatedCapture(wave_file, sampling_rate, master_clock)
+        hdl_capture = HDLCapture(dut, clock_rate, clock_rate, pdm=True)
+    else:
+        capture = StemCapture(dut if CAPTURE == "python" else None, wave_file, sampling_rate, chunk_size=sampling_rate * 2)
+        hdl_capture = HDLCapture(dut, capture_rate, clock_rate) if CAPTURE == "hdl" else None
+
+    profile.lap("setup")
+    start_time = cocotb.utils.get_sim_time(units="ps")
+    start_cycle = cycle
+    cycles_per_second = master_clock
+    next_flush = cycle + cycles_per_second
+    max_cycle = max_time * clock_rate // 16 if max_time > 0 else None
+    index = first
+
+    async def sample_until(deadline):
+        # Python capture: takes every sample due before `deadline` (in picoseconds), then waits for the deadline.
+        # Sample k is due k/sampling_rate after the start, computed from k, so the samples do not drift.
+        taken = 0
+        while True:
+            due = start_time + ((capture.total + 1) * 10**12) // sampling_rate
+            if due > deadline:
+                break
+            now = cocotb.utils.get_sim_time(units="ps")
+            if due > now:
+                await Timer(due - now, units="ps")
+            profile.lap("wait")
+            capture.sample()
+            profile.lap("read")
+            taken += 1
+        now = cocotb.utils.get_sim_time(units="ps")
+        if deadline > now:
+            await Timer(deadline - now, units="ps")
+        profile.count(awaits=taken + 1, gpi_reads=taken * len(capture.handles), gpi_sim_time=taken + 2)
+
+    async def advance(target):
+        # clocks the chip up to the cycle `target` with as few awaits as possible, at least once per second
+        # of the song the samples are drained and appended to the WAV files
+        nonlocal cycle, next_flush
+        while cycle < target:
+            step = min(target, next_flush) - cycle
+            if hdl_capture:
+                # samples are collected by tb.v meanwhile
+                await ClockCycles(dut.clk, step)
+                profile.count(awaits=1)
+                profile.lap("wait")
+                capture.extend(await hdl_capture.drain())
+                profile.lap("read")
+            else:
+                await sample_until(start_time + (cycle + step - start_cycle) * cycle_in_picoseconds)
+            cycle += step
+            if cycle == next_flush:
+                capture.flush()
+                profile.lap("wav")
+                profile.sample(index, (cocotb.utils.get_sim_time(units="ps") - start_time) / 1e12)
+                next_flush += cycles_per_second
+
+    if music is None:
+        schedule = event_schedule(samples, writes, end_sample, clock_rate)
+    else:
+        schedule = frame_schedule(music, playback_rate, clock_rate, first)
+    for index, write_cycle, program in schedule:
+        profile.lap("parse") # frames might be decoded lazily while iterating
+        if max_cycle is not None and write_cycle >= max_cycle:
+            await advance(max_cycle)
             break
-
-        if len(frame) > 0:
-            print("---", n, len(samples[0]), "---", [format(d, '08b') for d in frame], "---", "time in ms:", format(cur_time/1e6, "5.3f"),)
-        for val in frame:
-            dut.ui_in.value = val
-            dut.uio_in.value = WRITE_ENABLED
-            await ClockCycles(dut.clk, 1)
-            print_chip_state(dut)
-        dut.uio_in.value = WRITE_DISABLED
-
-        while cocotb.utils.get_sim_time(units="ns") < cur_time + (1e9 / fps):
-            await Timer(nanoseconds_per_sample, units="ns", round_mode="round")
-            for channel, data in enumerate(samples):
-                sample = get_sample(dut, channel)
-                assert sample >= 0
-                assert sample <= 32767
-                if True:
-                    sample *= 2
-                    sample -= 32767
-                    sample = -32767 if sample < -32767 else sample
-                    sample =  32767 if sample > 32767 else sample
-                assert np.int16(sample) == sample
-                data.append(sample)
-
-        print_chip_state(dut)
-
-        if n < fps:
-            n += 1
-        else:            
-            for ch, data in enumerate(samples):
-                write(wave_file[ch], sampling_rate, np.int16(data))
-            n = 0
+        await advance(write_cycle)
+        if trace:
+            trace(dut)
+            profile.lap("trace")
+        if len(program) == 0:
+            continue # end of the song
+
+        print("---", index, capture.total, "---", [format(d, '08b') for d in program], "---",
+              "time in ms:", format(cycle * 16e3 / clock_rate, "5.3f"),)
+        profile.lap("log")
+        await write_program(dut, program, WRITE_ENABLED, WRITE_DISABLED, flush=False, log=trace if TRACE > 1 else None)
+        cycle += len(program)
+        profile.lap("write")
+        profile.count(gpi_writes=len(program) + 2, awaits=len(program))
+
+    if hdl_capture:
+        capture.extend(await hdl_capture.close())
+
+    if SEGMENTS > 0 and last < boundaries[-1]:
+        await ReadOnly()
+        assert chip_state.matches(next_checkpoint), f"segment {SEGMENT} does not continue bit-exact into the next one"
+
+    if trace:
+        trace.close()
+    capture.close()
+    profile.lap("wav")
+    profile.save(f"{output_basename(vgm_filename)}{suffix}.profile.json",
+                 (cocotb.utils.get_sim_time(units="ps") - start_time) / 1e12)
 
     await ClockCycles(dut.clk, 16)
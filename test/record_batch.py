@@ -0,0 +1,124 @@
+# Records a whole library of songs with RTL simulation, every song by its own record.py run on a pool of workers.
+# Simulation is compiled once and shared, every song gets its own output directory, capture and results file.
+# Songs whose WAVs are newer than the song itself, the RTL and the recording scripts are skipped.
+# Manifest with duration, frames, clock, wall time and failures of every song is written into manifest.json
+#
+# How to run this script from command line:
+#
+# python record_batch.py
+#
+# Render a glob or a directory of .vgm, .vgz and .sn76489.bin files on 16 workers into a custom directory:
+#
+# SONGS="../music/MISSION76496*.vgm" WORKERS=16 BATCH_OUTPUT=../output/batch python record_batch.py
+#
+# The rest of environment variables (MAX_TIME, LOOP, CAPTURE, GATES, ...) are passed to record.py
+#
+
+import glob
+import json
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SONGS = os.environ.get("SONGS", "../music")
+BATCH_OUTPUT = os.environ.get("BATCH_OUTPUT", "../output/batch")
+MANIFEST = os.path.join(BATCH_OUTPUT, "manifest.json")
+
+WORKERS = os.cpu_count()
+try:
+    WORKERS = int(os.environ.get("WORKERS", WORKERS))
+except:
+    pass
+
+SIM_BUILD = "sim_build/gl" if os.environ.get("GATES") == "yes" else "sim_build/rtl"
+
+# changes to any of these files make the recorded WAVs out of date
+DEPENDENCIES = glob.glob("../src/*.v") + ["tb.v", "Makefile", "record.py", "registers.py", "vgmparse.py", "sn76489bin.py",
+                                          "sn76489.py", "lfsr.py", "resample.py", "chiptrace.py", "profiling.py", "wavwriter.py"]
+
+STEMS = ["master", "tone0", "tone1", "tone2", "noise"]
+
+def find_songs(pattern):
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "*")
+    songs = sorted(filename for filename in glob.glob(pattern)
+                   if filename.endswith((".vgm", ".vgz", ".sn76489.bin")))
+    # raw .sn76489.bin next to its VGM is used by record.py for validation only
+    return [song for song in songs if not (song.endswith(".sn76489.bin") and
+                                           os.path.exists(song[:-len(".sn76489.bin")] + ".vgm"))]
+
+def song_name(song):
+    return os.path.basename(song)
+
+def output_dir(song):
+    return os.path.join(BATCH_OUTPUT, song_name(song))
+
+def outputs(song):
+    # same names as record.py::output_basename() produces inside the output directory of the song
+    basename = os.path.join(output_dir(song), os.path.basename(song).rstrip('.vgm'))
+    return [f"{basename}.{stem}.wav" for stem in STEMS], f"{basename}.profile.json"
+
+def up_to_date(song):
+    wave_files, profile_file = outputs(song)
+    if not all(os.path.exists(filename) for filename in wave_files + [profile_file]):
+        return False
+    newest_input = max(os.path.getmtime(filename) for filename in [song] + DEPENDENCIES)
+    return min(os.path.getmtime(filename) for filename in wave_files + [profile_file]) > newest_input
+
+def record_song(song):
+    name = song_name(song)
+    os.makedirs(output_dir(song), exist_ok=True)
+    results_file = os.path.join(output_dir(song), "results.xml")
+    env = dict(os.environ, MODULE="record", VGM=os.path.abspath(song), OUTPUT_DIR=os.path.abspath(output_dir(song)),
+               CAPTURE_FILE=os.path.join(output_dir(song), "capture.bin"), COCOTB_RESULTS_FILE=results_file, DUMP="none")
+    start = time.time()
+    with open(os.path.join(output_dir(song), "record.log"), "w") as log:
+        process = subprocess.run(["make", f"SIM_BUILD={SIM_BUILD}"], env=env, stdout=log, stderr=subprocess.STDOUT)
+    entry = {'song': song, 'status': "recorded", 'wall_time': time.time() - start}
+
+    wave_files, profile_file = outputs(song)
+    failures = open(results_file).read().count("<failure") if os.path.exists(results_file) else 1
+    if process.returncode != 0 or failures or not os.path.exists(profile_file):
+        entry.update(status="failed", error=f"make exited with {process.returncode}, {failures} failures, see {log.name}")
+    else:
+        profile = json.load(open(profile_file))
+        entry.update(duration=profile['simulated_seconds'], frames=profile.get('frames'),
+                     clock=profile.get('clock_rate'), playback_rate=profile.get('playback_rate'),
+                     realtime_factor=profile['realtime_factor'], outputs=wave_files)
+    print(f"{name:45s} {entry['status']:9s} {entry['wall_time']:8.2f} sec")
+    return entry
+
+def load_manifest():
+    if not os.path.exists(MANIFEST):
+        return {}
+    return {entry['song']: entry for entry in json.load(open(MANIFEST))['songs']}
+
+if __name__ == "__main__":
+    songs = find_songs(SONGS)
+    previous = load_manifest()
+    os.makedirs(BATCH_OUTPUT, exist_ok=True)
+
+    # compile once, all workers share the same simulation build
+    process = subprocess.run(["make", f"{SIM_BUILD}/sim.vvp"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    assert process.returncode == 0, process.stdout
+
+    todo = [song for song in songs if not up_to_date(song)]
+    print(f"{len(songs)} songs, {len(songs) - len(todo)} up to date, recording {len(todo)} on {WORKERS} workers")
+    start = time.time()
+    # each worker thread just waits for its own simulator process
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        recorded = {entry['song']: entry for entry in pool.map(record_song, todo)}
+
+    entries = []
+    for song in songs:
+        if song in recorded:
+            entries.append(recorded[song])
+        else:
+            entries.append(dict(previous.get(song, {'song': song}), status="up to date"))
+    failed = [entry['song'] for entry in entries if entry['status'] == "failed"]
+    with open(MANIFEST, "w") as f:
+        json.dump({'time': time.strftime("%Y-%m-%d %H:%M:%S"), 'wall_time': time.time() - start,
+                   'songs': entries, 'failed': failed}, f, indent=2)
+    print(f"recorded {len(recorded)} songs in {time.time() - start:.2f} sec, {len(failed)} failed ->", MANIFEST)
+    exit(1 if failed else 0)
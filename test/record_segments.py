@@ -0,0 +1,90 @@
+# Records a song with RTL simulation split into segments that are simulated in parallel.
+# Every segment is a separate `make MODULE=record SEGMENTS=N SEGMENT=k CAPTURE=hdl` run of record.py
+# with its own sim_build, capture file and results file. Each run restores the chip state at the start
+# of its segment from a checkpoint and checks that it ends bit-exact in the state the next segment starts from.
+# Finally the segments are stitched into the same five stems as a single record.py run would produce.
+#
+# How to run this script from command line:
+#
+# VGM=../music/MISSION76496.bbc50hz.vgm MAX_TIME=60 WORKERS=16 python record_segments.py
+#
+# SEGMENTS defaults to WORKERS, the rest of environment variables (MAX_TIME, LOOP, CACHE, ...) are passed to record.py
+# Segments need access to the internal registers of the chip, thus RTL simulation only.
+#
+
+import os
+import subprocess
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from wavwriter import WavWriter
+from sn76489 import STEM_NAMES
+from record import VGM_FILENAME, OUTPUT_DIR, SAMPLING_RATE, output_basename
+
+WORKERS = os.cpu_count()
+try:
+    WORKERS = int(os.environ.get("WORKERS", WORKERS))
+except:
+    pass
+
+SEGMENTS = WORKERS
+try:
+    SEGMENTS = int(os.environ.get("SEGMENTS", SEGMENTS))
+except:
+    pass
+
+SIM_BUILD = "sim_build/segments"
+
+def output_filename(stem, segment=None):
+    suffix = f".seg{segment:03d}" if segment is not None else ""
+    return f"{output_basename(VGM_FILENAME)}.{stem}{suffix}"
+
+def record_segment(segment):
+    # runs the simulation of a single segment, returns the list of failed tests and wall time
+    results_file = f"results.seg{segment:03d}.xml"
+    env = dict(os.environ, MODULE="record", SEGMENTS=str(SEGMENTS), SEGMENT=str(segment), CAPTURE="hdl",
+               CAPTURE_FILE=f"capture.seg{segment:03d}.bin", COCOTB_RESULTS_FILE=results_file)
+    start = time.time()
+    with open(output_filename("log", segment), "w") as log:
+        process = subprocess.run(["make", f"SIM_BUILD={SIM_BUILD}/seg{segment:03d}"], env=env, stdout=log, stderr=subprocess.STDOUT)
+    elapsed = time.time() - start
+
+    failures = []
+    if process.returncode != 0 or not os.path.exists(results_file):
+        failures.append(f"make exited with {process.returncode}")
+    else:
+        for testcase in ET.parse(results_file).getroot().iter("testcase"):
+            if testcase.find("failure") is not None or testcase.find("error") is not None:
+                failures.append(testcase.get("name"))
+        os.remove(results_file)
+    if os.path.exists(env["CAPTURE_FILE"]):
+        os.remove(env["CAPTURE_FILE"])
+    return failures, elapsed
+
+def stitch_segments():
+    for stem in STEM_NAMES:
+        with WavWriter(output_filename(stem) + ".wav", SAMPLING_RATE) as wav:
+            for segment in range(SEGMENTS):
+                filename = output_filename(stem, segment) + ".wav"
+                wav.write(np.fromfile(filename, dtype='<i2', offset=WavWriter.HEADER_SIZE))
+                os.remove(filename)
+
+if __name__ == "__main__":
+    assert os.environ.get("GATES") != "yes", "segments restore internal registers of the chip, not available in gate level netlist"
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    print(VGM_FILENAME, f"-> {SEGMENTS} segments on {WORKERS} workers")
+    start = time.time()
+    # each worker thread just waits for its own simulator process
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        results = list(pool.map(record_segment, range(SEGMENTS)))
+
+    for segment, (failures, elapsed) in enumerate(results):
+        print(f"segment {segment:3d}: {elapsed:8.2f} sec", "FAILED: " + ", ".join(failures) if failures else "ok")
+    failed = [segment for segment, (failures, _) in enumerate(results) if failures]
+    assert not failed, f"segments {failed} failed, see {output_filename('log', failed[0])}"
+
+    stitch_segments()
+    print(f"recorded in {time.time() - start:.2f} sec ->", [output_filename(stem) + ".wav" for stem in STEM_NAMES])
@@ -0,0 +1,24 @@
+# Batched writes into the registers of the chip, shared by test.py and record.py
+#
+#   await write_program(dut, [0b1_00_0_1110, 0b00_001110], WRITE_ENABLED, WRITE_DISABLED)
+#
+# The whole sequence of bytes is driven on the data bus from a single coroutine, one byte per clock cycle,
+# and nothing is logged unless a `log` callback is passed.
+
+from cocotb.triggers import ClockCycles
+
+async def write_program(dut, program, write_enabled, write_disabled, flush=True, log=None):
+    # Puts every byte of the program on the data bus for one clock cycle with /WE held low.
+    # With flush /WE is kept high for one more clock cycle, otherwise it is just released.
+    # log(dut) is called after every clock cycle, if given.
+    dut.uio_in.value = write_enabled
+    for data in program:
+        dut.ui_in.value = data
+        await ClockCycles(dut.clk, 1)
+        if log:
+            log(dut)
+    dut.uio_in.value = write_disabled
+    if flush:
+        await ClockCycles(dut.clk, 1)
+        if log:
+            log(dut)
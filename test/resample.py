@@ -0,0 +1,78 @@
+# Band-limited streaming resampler from the update rate of the chip down to 44.1/48/96 kHz
+#
+# Rational polyphase FIR: the input rate is conceptually upsampled by L, low-pass filtered by a Kaiser-windowed sinc
+# and downsampled by M, where L/M = output rate / input rate. Only the taps of the one phase that lands on every
+# output sample are evaluated, all output samples of a chunk at once with NumPy.
+# Only the last `taps` input samples are kept between chunks, thus memory stays bounded for any song length.
+#
+#   decimator = Decimator(250_000, 44100, channels=5)
+#   for chunk in chunks:                # raw values of shape (channels, n) at 250 kHz
+#       wav.write(decimator.process(chunk))
+#   wav.write(decimator.flush())        # the tail delayed by the filter
+
+from math import gcd
+import numpy as np
+
+class Decimator:
+    def __init__(self, input_rate, output_rate, channels=1, zero_crossings=16, passband=0.9, beta=8.6, block=4096):
+        divisor = gcd(input_rate, output_rate)
+        self.up = output_rate // divisor    # L
+        self.down = input_rate // divisor   # M
+        self.channels = channels
+        self.block = block
+
+        # prototype low-pass at the upsampled rate, cutoff below the Nyquist of the lower of both rates
+        ratio = max(1.0, input_rate / output_rate)
+        self.taps = int(np.ceil(2 * zero_crossings * ratio))
+        length = self.taps * self.up
+        cutoff = passband * 0.5 / (self.up * ratio) # cycles per upsampled sample
+        t = np.arange(length) - (length - 1) / 2
+        prototype = 2 * cutoff * np.sinc(2 * cutoff * t) * np.kaiser(length, beta)
+
+        # phase p holds prototype[p + j*L], reversed so that it lines up with input samples in ascending order;
+        # every phase is normalized to unit DC gain, constant levels pass through unchanged
+        phases = prototype.reshape(self.taps, self.up).T[:, ::-1]
+        self.phases = (phases / phases.sum(axis=1, keepdims=True)).astype(np.float32)
+
+        # output sample n is centered on input position n*M/L, filter delay is compensated by `shift`
+        self.shift = length // 2
+        self.history = np.zeros((channels, self.taps - 1), dtype=np.float32) # input samples before `offset`
+        self.offset = 0     # absolute index of the first new input sample
+        self.produced = 0   # output samples produced so far
+        self.consumed = 0   # input samples received so far
+
+    def available(self, inputs):
+        # number of output samples whose whole filter window lies within the first `inputs` input samples
+        # newest input sample used by output n is (n*M + shift) // L
+        return max(0, (inputs * self.up - self.shift - 1) // self.down + 1)
+
+    def process(self, chunk):
+        # consumes raw input of shape (channels, n), returns filtered output of shape (channels, m) as float32
+        chunk = np.asarray(chunk, dtype=np.float32).reshape(self.channels, -1)
+        self.consumed += chunk.shape[1]
+        return self._emit(chunk, self.available(self.consumed))
+
+    def flush(self):
+        # emits the remaining output samples up to the end of the input, the filter is fed with the last input value
+        total = -(-self.consumed * self.up // self.down) # ceil
+        padding = self.taps + self.shift // self.up + 1
+        last = self.history[:, -1:] if self.history.shape[1] else np.zeros((self.channels, 1), dtype=np.float32)
+        return self._emit(np.repeat(last, padding, axis=1), total)
+
+    def _emit(self, chunk, until):
+        data = np.concatenate([self.history, chunk], axis=1)
+        start = self.offset - self.history.shape[1] # absolute index of data[:, 0]
+        windows = np.lib.stride_tricks.sliding_window_view(data, self.taps, axis=1)
+        outputs = []
+        for first in range(self.produced, until, self.block):
+            n = np.arange(first, min(first + self.block, until), dtype=np.int64)
+            position = n * self.down + self.shift
+            newest = position // self.up
+            rows = newest - (self.taps - 1) - start
+            outputs.append(np.einsum('cnt,nt->cn', windows[:, rows], self.phases[position % self.up]))
+        self.produced = max(self.produced, until)
+        self.offset += chunk.shape[1]
+        self.history = data[:, data.shape[1] - (self.taps - 1):] if self.taps > 1 else data[:, :0]
+        if not outputs:
+            return np.zeros((self.channels, 0), dtype=np.float32)
+        return np.concatenate(outputs, axis=1)
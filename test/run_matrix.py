@@ -0,0 +1,131 @@
+# Runs the cocotb tests from test.py for several chip configurations at once,
+# every test of every configuration (a shard) runs in its own simulator process filtered with TESTCASE.
+# Shards of configurations that compile to the same netlist share the same sim_build, it is compiled only once.
+# Results of all shards are merged into results.xml with one testsuite per configuration,
+# wall time of every shard is stored in the `wall_time` attribute of its testcase.
+#
+# How to run this script from command line:
+#
+# python run_matrix.py
+#
+# Run only some configurations or tests on 8 workers:
+#
+# CONFIGS=sel1,sel2 TESTS=test_tone_1,test_tone_max WORKERS=8 python run_matrix.py
+#
+# Configuration `gates` runs gate level simulation and requires gate_level_netlist.v, see README.md
+#
+
+import ast
+import os
+import subprocess
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+# configuration name -> variables passed to make and test.py
+# NOTE: test.py defaults to SEL=1 and takes MASTER_CLOCK into account only when SEL is empty
+CONFIGURATIONS = {
+    'sel0':  {'SEL': '0'},
+    'sel1':  {'SEL': '1'},
+    'sel2':  {'SEL': '2'},
+    'ntsc':  {'SEL': '', 'MASTER_CLOCK': 'NTSC'},
+    'gates': {'GATES': 'yes'},
+}
+
+CONFIGS = [config for config in CONFIGURATIONS if config != 'gates' or os.path.exists("gate_level_netlist.v")]
+CONFIGS = os.environ.get("CONFIGS", ",".join(CONFIGS)).split(",")
+
+TESTS = os.environ.get("TESTS", "")
+
+WORKERS = os.cpu_count()
+try:
+    WORKERS = int(os.environ.get("WORKERS", WORKERS))
+except:
+    pass
+
+RESULTS_DIR = "sim_build/matrix"
+RESULTS_FILE = "results.xml"
+
+def list_tests(filename="test.py"):
+    # names of the coroutines decorated with @cocotb.test() in the order they are defined
+    tree = ast.parse(open(filename).read())
+    return [node.name for node in tree.body if isinstance(node, ast.AsyncFunctionDef) and
+            any(ast.unparse(decorator).startswith("cocotb.test") for decorator in node.decorator_list)]
+
+def sim_build(config):
+    # same as SIM_BUILD in the Makefile, configurations differ only in Python arguments otherwise
+    return "sim_build/gl" if CONFIGURATIONS[config].get('GATES') == 'yes' else "sim_build/rtl"
+
+def make_env(config, **variables):
+    # all shards run in the same directory, thus the waveform dump is disabled
+    return dict(os.environ, **CONFIGURATIONS[config], DUMP="none", **variables)
+
+def compile_sim(config):
+    process = subprocess.run(["make", f"{sim_build(config)}/sim.vvp"], env=make_env(config),
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    assert process.returncode == 0, f"compilation of {config} failed:\n{process.stdout}"
+
+def run_shard(shard):
+    config, test = shard
+    results_file = os.path.join(RESULTS_DIR, f"{config}.{test}.xml")
+    if os.path.exists(results_file):
+        os.remove(results_file)
+    start = time.time()
+    with open(os.path.join(RESULTS_DIR, f"{config}.{test}.log"), "w") as log:
+        process = subprocess.run(["make"], env=make_env(config, TESTCASE=test, COCOTB_RESULTS_FILE=results_file),
+                                 stdout=log, stderr=subprocess.STDOUT)
+    wall_time = time.time() - start
+
+    testcase = None
+    if os.path.exists(results_file):
+        testcase = next((node for node in ET.parse(results_file).getroot().iter("testcase") if node.get("name") == test), None)
+    if testcase is None:
+        testcase = ET.Element("testcase", name=test, classname="test")
+        ET.SubElement(testcase, "failure", message=f"simulator exited with {process.returncode} without results")
+    testcase.set("wall_time", f"{wall_time:.2f}")
+    return testcase
+
+def merge_results(shards, testcases):
+    root = ET.Element("testsuites", name="results")
+    suites = {}
+    for (config, test), testcase in zip(shards, testcases):
+        if config not in suites:
+            suites[config] = ET.SubElement(root, "testsuite", name=config, package=config)
+        suites[config].append(testcase)
+    ET.ElementTree(root).write(RESULTS_FILE, encoding="UTF-8", xml_declaration=True)
+
+def previous_wall_times():
+    # wall times of the shards from the last run, used to start the slowest shards first
+    if not os.path.exists(RESULTS_FILE):
+        return {}
+    try:
+        return {(suite.get("name"), testcase.get("name")): float(testcase.get("wall_time"))
+                for suite in ET.parse(RESULTS_FILE).getroot().iter("testsuite")
+                for testcase in suite.iter("testcase") if testcase.get("wall_time")}
+    except ET.ParseError:
+        return {}
+
+def failed(testcase):
+    return testcase.find("failure") is not None or testcase.find("error") is not None
+
+if __name__ == "__main__":
+    tests = TESTS.split(",") if TESTS else list_tests()
+    shards = [(config, test) for config in CONFIGS for test in tests]
+    wall_times = previous_wall_times()
+    shards.sort(key=lambda shard: -wall_times.get(shard, 0))
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+
+    start = time.time()
+    builds = {sim_build(config): config for config in CONFIGS}
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        list(pool.map(compile_sim, builds.values()))
+        # each worker thread just waits for its own simulator process
+        testcases = list(pool.map(run_shard, shards))
+    elapsed = time.time() - start
+
+    merge_results(shards, testcases)
+    for (config, test), testcase in sorted(zip(shards, testcases), key=lambda item: -float(item[1].get("wall_time"))):
+        print(f"{config:6s} {test:55s} {float(testcase.get('wall_time')):8.2f} sec", "FAIL" if failed(testcase) else "PASS")
+    failures = sum(failed(testcase) for testcase in testcases)
+    print(f"{len(shards)} tests, {failures} failed, wall time {elapsed:.2f} sec on {WORKERS} workers -> {RESULTS_FILE}")
+    exit(1 if failures else 0)
@@ -0,0 +1,531 @@
+# Reference model of tt_um_rejunity_sn76489 written in Python/NumPy.
+# Renders VGM files to WAV without a Verilog simulator, about a hundred times faster than real time.
+#
+# How to run this script from command line:
+#
+# VGM=../music/MISSION76496.bbc50hz.vgm MAX_TIME=10 python sn76489.py
+#
+# It accepts the same VGM / MAX_TIME / LOOP environment variables as record.py
+# and produces the same five stems (master, tone0, tone1, tone2, noise) in ../output/
+#
+# Between register writes the chip is evaluated on every sample, RENDERER=events evaluates it only on the cycles
+# where an audible channel changes its output instead (both are bit-exact). Events pay off for sparse songs with long
+# sustained notes, on busy songs evaluating every sample is as fast or faster.
+#
+# WORKERS=16 splits the song into segments rendered in parallel by a pool of 16 processes,
+# each segment starts from a checkpoint of the chip state and the seams are checked to be bit-exact.
+#
+# The model follows src/tt_um_rejunity_sn76489.v cycle for cycle:
+#   - step() clocks the chip exactly as RTL does for a single cycle (used for register writes)
+#   - between the writes the chip is fully deterministic, so tone counters, noise counter and
+#     LFSR are evaluated in closed form for whole blocks of cycles at once with NumPy
+
+import os
+import time
+import itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.io.wavfile import write
+from lfsr import LFSR
+
+NUM_TONES = 3
+NUM_NOISES = 1
+NUM_CHANNELS = NUM_TONES + NUM_NOISES
+CHANNEL_OUTPUT_BITS = 10
+MASTER_OUTPUT_BITS = 8
+MASTER_ACCUMULATOR_BITS = 2 + CHANNEL_OUTPUT_BITS
+LFSR_BITS = 15
+
+# SEE: src/noise.v, taps 0/1 of the 15 bit LFSR
+NOISE_LFSR = LFSR.variant('bbc')
+
+# SEE: src/noise.v, NF0/NF1 bits select bit 4, 5 or 6 of the noise counter
+NOISE_COUNTER_BITS = [4, 5, 6]
+
+# Clock dividers selected by SEL pins, SEE: clk_master_strobe in src/tt_um_rejunity_sn76489.v
+CLOCK_DIV = {0: 16, 1: 1, 2: 128}
+
+def attenuation_table(volume_bits=CHANNEL_OUTPUT_BITS):
+    # SEE: src/attenuation.v, each step is 2dB, step 15 is a complete silence
+    max_volume = (1 << volume_bits) - 1
+    steps = [1.0, 0.79432823, 0.63095734, 0.50118723, 0.39810717, 0.31622777, 0.25118864, 0.19952623,
+             0.15848932, 0.12589254, 0.10000000, 0.07943282, 0.06309573, 0.05011872, 0.03981072]
+    table = [max_volume] + [max(int(max_volume * step), 1) for step in steps[1:]] + [0]
+    return np.array(table, dtype=np.uint16)
+
+ATTENUATION = attenuation_table()
+
+class SN76489:
+    def __init__(self, clock_div=1):
+        assert clock_div in CLOCK_DIV.values()
+        self.clock_div = clock_div
+        self.reset()
+
+    def reset(self):
+        self.cycles = 0
+        self.clk_counter = 0
+
+        self.control_attn = [15, 15, 15, 15]
+        self.control_tone_freq = [1, 1, 1]
+        self.control_noise = 0b100
+        self.latch_control_reg = 0
+        self.restart_noise = 0
+
+        self.tone_counter = [0, 0, 0]
+        self.tone_state = [0, 0, 0]
+
+        self.noise_counter = 0
+        self.noise_trigger = 0          # previous_signal_state_0 of signal_edge
+        self.lfsr = 1 << (LFSR_BITS-1)
+
+    # Checkpoints ##############################################################
+
+    STATE = ['cycles', 'clk_counter', 'control_attn', 'control_tone_freq', 'control_noise', 'latch_control_reg',
+             'restart_noise', 'tone_counter', 'tone_state', 'noise_counter', 'noise_trigger', 'lfsr']
+
+    def state(self):
+        # complete state of the chip as a plain dict, rendering continues bit-exact after load_state()
+        return {name: list(value) if isinstance(value, list) else value
+                for name, value in ((name, getattr(self, name)) for name in self.STATE)}
+
+    def load_state(self, state):
+        for name in self.STATE:
+            value = state[name]
+            setattr(self, name, list(value) if isinstance(value, list) else value)
+
+    # State of a single cycle ##################################################
+
+    def strobe(self):
+        return self.clk_counter % self.clock_div == 0
+
+    def trigger(self):
+        nf = self.control_noise & 3
+        if nf == 3:
+            return self.tone_state[NUM_TONES-1]
+        return (self.noise_counter >> NOISE_COUNTER_BITS[nf]) & 1
+
+    def channels(self):
+        return self.tone_state + [self.lfsr & 1]
+
+    def volumes(self):
+        return [int(ATTENUATION[attn]) if ch else 0 for ch, attn in zip(self.channels(), self.control_attn)]
+
+    def output(self):
+        master = sum(self.volumes())
+        if master >> MASTER_ACCUMULATOR_BITS:
+            return (1 << MASTER_OUTPUT_BITS) - 1
+        return master >> (MASTER_ACCUMULATOR_BITS - MASTER_OUTPUT_BITS)
+
+    def step(self, data=None):
+        # Clock the chip for a single cycle, optionally with /WE low and data on the bus.
+        # All registers are updated from the values they had before the clock edge.
+        enable = self.strobe()
+        trigger = self.trigger()
+        trigger_edge = trigger and not self.noise_trigger
+
+        for i in range(NUM_TONES):
+            if enable:
+                if self.tone_counter[i] == 0:
+                    self.tone_counter[i] = (self.control_tone_freq[i] - 1) & 1023
+                    self.tone_state[i] ^= 1
+                else:
+                    self.tone_counter[i] -= 1
+
+        if enable:
+            self.noise_counter = (self.noise_counter + 1) & 127
+        self.noise_trigger = trigger
+        if self.restart_noise:
+            self.lfsr = 1 << (LFSR_BITS-1)
+        elif trigger_edge:
+            feedback = self.lfsr & 1
+            if self.control_noise & 4:
+                feedback ^= (self.lfsr >> 1) & 1
+            self.lfsr = (feedback << (LFSR_BITS-1)) | (self.lfsr >> 1)
+
+        self.clk_counter = (self.clk_counter + 1) & 127
+        self.restart_noise = 0
+        if data is not None:
+            self.decode(data)
+        self.cycles += 1
+
+    def decode(self, data):
+        if data & 0x80:
+            reg = (data >> 4) & 7
+            if reg == 0b110:
+                self.control_noise = data & 7
+                self.restart_noise = 1
+            elif reg & 1:
+                self.control_attn[reg >> 1] = data & 15
+            else:
+                tone = reg >> 1
+                self.control_tone_freq[tone] = (self.control_tone_freq[tone] & 0x3f0) | (data & 15)
+            self.latch_control_reg = reg
+        else:
+            reg = self.latch_control_reg
+            if reg & 1:
+                self.control_attn[reg >> 1] = data & 15
+            elif reg != 0b110:
+                tone = reg >> 1
+                self.control_tone_freq[tone] = (self.control_tone_freq[tone] & 15) | ((data & 63) << 4)
+
+    def write(self, data):
+        self.step(data)
+
+    # Blocks of cycles without register writes #################################
+
+    def enabled(self, cycles):
+        # number of cycles with clk_master_strobe among the next `cycles` cycles
+        if self.clock_div == 1:
+            return cycles
+        return (self.clk_counter + cycles - 1) // self.clock_div - (self.clk_counter - 1) // self.clock_div
+
+    def tone_toggles(self, i, enabled):
+        period = self.control_tone_freq[i] or 1024
+        counter = self.tone_counter[i]
+        return np.maximum(enabled + (period - 1 - counter), 0) // period
+
+    def noise_triggers(self, enabled):
+        # number of trigger edges within the cycles preceding each `enabled` count, see signal_edge.v
+        nf = self.control_noise & 3
+        first = self.trigger() and not self.noise_trigger
+        if nf == 3:
+            toggles = self.tone_toggles(NUM_TONES-1, enabled)
+            rising = toggles // 2 if self.tone_state[NUM_TONES-1] else (toggles + 1) // 2
+            return first + rising
+        bit = 1 << NOISE_COUNTER_BITS[nf]
+        return first + (self.noise_counter + enabled - bit) // (bit * 2) - (self.noise_counter - bit) // (bit * 2)
+
+    def lfsr_sequence(self, lfsr, shifts):
+        # bit 0 of the LFSR after 0..shifts shifts, followed by the remaining LFSR_BITS-1 bits of the final state
+        length = shifts + LFSR_BITS
+        if not self.control_noise & 4:
+            return ((lfsr >> (np.arange(length) % LFSR_BITS)) & 1).astype(np.uint8)
+        # white noise is a slice of the precomputed sequence, see lfsr.py
+        return NOISE_LFSR.output(lfsr, length, white=True)
+
+    def run(self, offsets, cycles=None):
+        # Evaluates the channel outputs after `offsets` cycles (non-decreasing numpy array)
+        # and then advances the chip by `cycles` cycles, by default up to the last offset.
+        # Returns an array of shape (NUM_CHANNELS, len(offsets)) with 0/1 channel states.
+        offsets = np.asarray(offsets, dtype=np.int64)
+        if cycles is None:
+            cycles = int(offsets[-1]) if len(offsets) > 0 else 0
+        assert len(offsets) == 0 or (offsets[0] >= 0 and offsets[-1] <= cycles)
+
+        points = np.append(offsets, cycles)
+        enabled = self.enabled(points)
+        enabled_before_last_edge = self.enabled(np.maximum(points - 1, 0))
+
+        out = np.empty((NUM_CHANNELS, len(points)), dtype=np.uint8)
+        for i in range(NUM_TONES):
+            out[i] = self.tone_state[i] ^ (self.tone_toggles(i, enabled) & 1)
+
+        # Noise trigger is evaluated before each clock edge, thus LFSR after `k` cycles
+        # was shifted by the trigger edges that happened during the cycles 0..k-1.
+        # If restart_noise is pending, the very first cycle reloads LFSR instead.
+        triggers = self.noise_triggers(enabled_before_last_edge)
+        if self.restart_noise:
+            lfsr = 1 << (LFSR_BITS-1)
+            triggers = triggers - int(self.noise_triggers(0))
+        else:
+            lfsr = self.lfsr
+        shifts = np.where(points > 0, triggers, 0)
+        sequence = self.lfsr_sequence(lfsr, int(shifts[-1]))
+        out[NUM_TONES] = np.where(points > 0, sequence[shifts], self.lfsr & 1)
+
+        if cycles > 0:
+            nf = self.control_noise & 3
+            if nf == 3:
+                trigger = self.tone_state[NUM_TONES-1] ^ (int(self.tone_toggles(NUM_TONES-1, enabled_before_last_edge[-1])) & 1)
+            else:
+                trigger = ((self.noise_counter + int(enabled_before_last_edge[-1])) >> NOISE_COUNTER_BITS[nf]) & 1
+
+            total = int(enabled[-1])
+            for i in range(NUM_TONES):
+                counter = self.tone_counter[i]
+                period = self.control_tone_freq[i] or 1024
+                if total <= counter:
+                    self.tone_counter[i] = counter - total
+                else:
+                    self.tone_counter[i] = period - 1 - ((total - 1 - counter) % period)
+                self.tone_state[i] = int(out[i, -1])
+            self.noise_counter = (self.noise_counter + total) & 127
+            self.noise_trigger = trigger
+            self.lfsr = int(np.dot(sequence[-LFSR_BITS:].astype(np.int64), 1 << np.arange(LFSR_BITS)))
+            self.clk_counter = (self.clk_counter + cycles) & 127
+            self.restart_noise = 0
+            self.cycles += cycles
+        return out[:, :-1]
+
+# Rendering ###################################################################
+
+STEM_NAMES = ["master", "tone0", "tone1", "tone2", "noise"]
+
+def mix(states, attn):
+    # states: 0/1 channel outputs of shape (NUM_CHANNELS, n), attn: attenuation control of every channel per sample
+    # returns raw values of the 5 stems as record.py reads them: uo_out << 7 and attenuation.out of every channel
+    volumes = states * ATTENUATION[attn]
+    master = volumes.sum(axis=0, dtype=np.uint32)
+    master = np.where(master >> MASTER_ACCUMULATOR_BITS, (1 << MASTER_OUTPUT_BITS) - 1,
+                                                          master >> (MASTER_ACCUMULATOR_BITS - MASTER_OUTPUT_BITS))
+    return np.vstack([master << 7, volumes])
+
+def to_int16(raw):
+    # same scaling as play_and_record_wav in record.py
+    return np.clip(raw.astype(np.int32) * 2 - 32767, -32767, 32767).astype(np.int16)
+
+def sample_cycles(frames, playback_rate, clock_rate, max_time=-1, sampling_rate=44100):
+    # Sample `k` is taken after floor(k * clock_rate / 16 / sampling_rate) cycles (same as capture_phase in tb.v),
+    # computed from the exact clock rate, thus samples do not drift even if the clock rate is not a multiple of 16
+    duration = frames / playback_rate
+    if max_time > 0:
+        duration = min(duration, max_time)
+    samples = int(duration * sampling_rate)
+    return (np.arange(1, samples + 1, dtype=np.int64) * clock_rate) // (16 * sampling_rate)
+
+def capture_phase(cycle, capture_rate, capture_clock):
+    # Accumulator of the sample capture in tb.v at the start of `cycle`, record.py seeds it when it seeks.
+    # Samples due up to the cycle before were taken already, a sample due exactly at `cycle` is still pending
+    taken = max((cycle * capture_rate - 1) // capture_clock, 0)
+    return cycle * capture_rate - taken * capture_clock
+
+def frame_cycle(frame_index, playback_rate, clock_rate):
+    # first cycle of the frame at the chip running at clock_rate/16
+    return (frame_index * clock_rate) // (16 * playback_rate)
+
+def render_segment(frames, playback_rate, clock_rate, sample_cycles, first=0, state=None, until=None):
+    # Renders frames of register writes as produced by record.py::load_vgm, `frames` start at frame number `first`.
+    # Chip is configured without clock divider (SEL=1) and clocked at clock_rate/16 just like in record.py.
+    # Register writes of a frame happen on consecutive cycles starting at the beginning of the frame.
+    # Chip starts from `state` (see SN76489.state(), reset chip by default), takes samples at `sample_cycles`
+    # and then advances up to the cycle `until`, if given.
+    # Returns raw stems of shape (5, len(sample_cycles)) and the state of the chip at the end.
+    samples = len(sample_cycles)
+
+    # channel states and attenuation controls are collected per sample and mixed at the very end
+    chip = SN76489(clock_div=1)
+    if state is not None:
+        chip.load_state(state)
+    states = np.zeros((NUM_CHANNELS, samples), dtype=np.uint16)
+    attn = np.full((NUM_CHANNELS, samples), 15, dtype=np.uint8)
+    s = 0
+    def advance(cycle):
+        nonlocal s
+        e = np.searchsorted(sample_cycles, cycle, side='right')
+        states[:, s:e] = chip.run(sample_cycles[s:e] - chip.cycles, max(cycle - chip.cycles, 0))
+        attn[:, s:e] = np.array(chip.control_attn)[:, None]
+        s = e
+
+    for index, frame in enumerate(frames, start=first):
+        if len(frame) == 0:
+            continue
+        advance(frame_cycle(index, playback_rate, clock_rate))
+        for val in frame:
+            chip.write(val)
+            while s < samples and sample_cycles[s] == chip.cycles:
+                states[:, s] = chip.channels()
+                attn[:, s] = chip.control_attn
+                s += 1
+    if s < samples:
+        advance(int(sample_cycles[-1]))
+    if until is not None:
+        advance(until)
+
+    return mix(states, attn), chip.state()
+
+def change_points(chip, cycles):
+    # Cycles (1..cycles) after which the output of an audible channel might change, computed in closed form
+    # from the current state of the chip. Silent channels are skipped, their state is multiplied by 0 anyway.
+    # Points are a superset of the actual changes (duplicates included), the channel states are evaluated
+    # exactly at them by run().
+    assert chip.clock_div == 1
+    points = [np.ones(1, dtype=np.int64)] # pending restart_noise or trigger edge
+    def tone_toggles(i, until):
+        period = chip.control_tone_freq[i] or 1024
+        return np.arange(chip.tone_counter[i] + 1, until + 1, period, dtype=np.int64)
+    for i in range(NUM_TONES):
+        if chip.control_attn[i] != 15:
+            points.append(tone_toggles(i, cycles))
+    if chip.control_attn[NUM_TONES] != 15:
+        nf = chip.control_noise & 3
+        if nf == 3:
+            # LFSR shifts on the cycle following the toggle of the last tone
+            points.append(tone_toggles(NUM_TONES-1, cycles - 1) + 1)
+        else:
+            bit = 1 << NOISE_COUNTER_BITS[nf]
+            points.append(np.arange(1 + (bit - chip.noise_counter) % (bit * 2), cycles + 1, bit * 2, dtype=np.int64))
+    return np.sort(np.concatenate(points)) if len(points) > 1 else points[0]
+
+def render_events(frames, playback_rate, clock_rate, sample_cycles, first=0, state=None, until=None):
+    # Same as render_segment(), but instead of evaluating the chip on every sample, the chip is evaluated only
+    # on the cycles where the output might change (see change_points()) and on register writes.
+    # The output is kept as runs of constant channel states and attenuations that are expanded into samples
+    # only at the very end, thus silent and sustained passages cost next to nothing.
+    # Blocks of fast tones with more changes than samples are evaluated on the samples instead.
+    chip = SN76489(clock_div=1)
+    if state is not None:
+        chip.load_state(state)
+    cycles_per_sample = (int(sample_cycles[-1]) - int(sample_cycles[0])) / max(len(sample_cycles) - 1, 1) \
+                        if len(sample_cycles) > 0 else 0
+    # run starts at cycle `times[k]` with channel states `states[k]` and attenuation controls `attn[k]`,
+    # runs started by register writes are collected in plain lists and converted once per frame
+    times, states, attn = [], [], []
+    writes = [[chip.cycles], [chip.channels()], [list(chip.control_attn)]]
+    def flush_writes():
+        if writes[0]:
+            times.append(np.array(writes[0], dtype=np.int64))
+            states.append(np.array(writes[1], dtype=np.uint8).T)
+            attn.append(np.array(writes[2], dtype=np.uint8).T)
+            for column in writes:
+                column.clear()
+    def advance(cycle):
+        cycles = cycle - chip.cycles
+        if cycles <= 0:
+            return
+        flush_writes()
+        points = change_points(chip, cycles)
+        if len(points) * cycles_per_sample > cycles:
+            s, e = np.searchsorted(sample_cycles, [chip.cycles, cycle], side='right')
+            if len(points) > e - s:
+                points = sample_cycles[s:e] - chip.cycles
+        control_attn = np.array(chip.control_attn, dtype=np.uint8)[:, None]
+        times.append(points + chip.cycles)
+        states.append(chip.run(points, cycles))
+        attn.append(np.repeat(control_attn, len(points), axis=1))
+
+    for index, frame in enumerate(frames, start=first):
+        if len(frame) == 0:
+            continue
+        advance(frame_cycle(index, playback_rate, clock_rate))
+        for val in frame:
+            chip.write(val)
+            writes[0].append(chip.cycles)
+            writes[1].append(chip.channels())
+            writes[2].append(list(chip.control_attn))
+    if len(sample_cycles) > 0:
+        advance(int(sample_cycles[-1]))
+    if until is not None:
+        advance(until)
+    flush_writes()
+
+    # runs are mixed once each and repeated for every sample they hold, a sample belongs to the last run
+    # that started at or before it, runs overridden on the same cycle hold no samples
+    starts = np.searchsorted(sample_cycles, np.concatenate(times), side='left')
+    lengths = np.diff(starts, append=len(sample_cycles))
+    raw = mix(np.hstack(states).astype(np.uint16), np.hstack(attn))
+    return np.repeat(raw, lengths, axis=1), chip.state()
+
+RENDERERS = {'samples': render_segment, 'events': render_events}
+
+def frames_to_render(music, playback_rate, clock_rate, sample_cycles):
+    # frames starting at or after the last sample do not affect the output
+    if len(sample_cycles) == 0:
+        return 0
+    return int(np.searchsorted(frame_cycle(np.arange(len(music), dtype=np.int64), playback_rate, clock_rate),
+                               sample_cycles[-1], side='left'))
+
+def render(music, playback_rate, clock_rate, max_time=-1, sampling_rate=44100, renderer="samples"):
+    # Renders the whole song into 5 int16 stems in a single process
+    cycles = sample_cycles(len(music), playback_rate, clock_rate, max_time, sampling_rate)
+    frames = frames_to_render(music, playback_rate, clock_rate, cycles)
+    raw, state = RENDERERS[renderer](music[:frames], playback_rate, clock_rate, cycles)
+    return to_int16(raw)
+
+def checkpoints(music, playback_rate, clock_rate, boundaries):
+    # Chip state at the start of every frame in `boundaries` (ascending frame numbers), before its register writes.
+    # Only register writes are replayed and the cycles in between are evaluated in closed form, thus it is fast.
+    states = []
+    state = None
+    previous = 0
+    for boundary in boundaries:
+        until = frame_cycle(boundary, playback_rate, clock_rate)
+        _, state = render_segment(music[previous:boundary], playback_rate, clock_rate, np.zeros(0, dtype=np.int64),
+                                  first=previous, state=state, until=until)
+        states.append(state)
+        previous = boundary
+    return states
+
+def control_program(state):
+    # Shortest sequence of register writes that brings the control registers of a reset chip into `state`,
+    # the register latched in `state` is written last, so subsequent data bytes go to the same register.
+    # Counters and LFSR are not part of it, they start from their reset values.
+    writes = {0b110: [0x80 | (0b110 << 4) | state['control_noise']]}
+    for tone in range(NUM_TONES):
+        freq = state['control_tone_freq'][tone]
+        writes[tone << 1] = [0x80 | (tone << 5) | (freq & 15), (freq >> 4) & 63]
+    for channel in range(NUM_CHANNELS):
+        writes[(channel << 1) | 1] = [0x80 | (channel << 5) | 0x10 | state['control_attn'][channel]]
+    latched = state['latch_control_reg']
+    return bytes(data for reg in sorted(writes, key=lambda reg: reg == latched) for data in writes[reg])
+
+def segment_boundaries(frames, segments):
+    # first frame of every segment followed by the total number of frames
+    boundaries = sorted(set(np.linspace(0, frames, segments + 1).astype(int).tolist()))
+    return boundaries if len(boundaries) > 1 else [0, frames]
+
+def render_parallel(music, playback_rate, clock_rate, max_time=-1, sampling_rate=44100, workers=None, segments=None,
+                    renderer="samples"):
+    # Splits the song into segments and renders them in a pool of worker processes.
+    # Every segment starts from the checkpoint of the chip state at its first frame,
+    # segments are stitched back together and every seam is checked to continue bit-exact:
+    # the state at the end of a segment must equal the checkpoint the next segment started from.
+    workers = workers or os.cpu_count()
+    segments = segments or workers
+    cycles = sample_cycles(len(music), playback_rate, clock_rate, max_time, sampling_rate)
+    frames = frames_to_render(music, playback_rate, clock_rate, cycles)
+
+    boundaries = segment_boundaries(frames, segments)
+    states = [None] + checkpoints(music, playback_rate, clock_rate, boundaries[1:-1])
+    ends = [frame_cycle(boundary, playback_rate, clock_rate) for boundary in boundaries[1:-1]] + [None]
+    splits = [0] + np.searchsorted(cycles, ends[:-1], side='right').tolist() + [len(cycles)]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(RENDERERS[renderer], music[first:last], playback_rate, clock_rate, cycles[s:e],
+                               first, state, until)
+                   for first, last, s, e, state, until in zip(boundaries[:-1], boundaries[1:], splits[:-1], splits[1:], states, ends)]
+        results = [future.result() for future in futures]
+
+    for n, ((_, end_state), next_state) in enumerate(zip(results, states[1:])):
+        assert end_state == next_state, f"segment {n} does not continue bit-exact into segment {n+1}"
+    return to_int16(np.hstack([raw for raw, _ in results]))
+
+def render_vgm(vgm_filename, max_time=-1, loop=0, sampling_rate=44100, workers=1, renderer="samples"):
+    from record import load_vgm, vgm_loop_frame, loop_frames
+    music, playback_rate, clock_rate = load_vgm(vgm_filename)
+    if loop > 0:
+        music = list(loop_frames(music, vgm_loop_frame(vgm_filename), loop))
+    elif loop < 0:
+        # endless loop is cut right after MAX_TIME, same as in record.py
+        assert max_time > 0, "LOOP=-1 needs MAX_TIME"
+        music = list(itertools.islice(loop_frames(music, vgm_loop_frame(vgm_filename)), int(max_time * playback_rate) + 1))
+    if workers > 1:
+        stems = render_parallel(music, playback_rate, clock_rate, max_time=max_time, sampling_rate=sampling_rate, workers=workers,
+                                renderer=renderer)
+    else:
+        stems = render(music, playback_rate, clock_rate, max_time=max_time, sampling_rate=sampling_rate, renderer=renderer)
+    return stems, playback_rate, clock_rate
+
+WORKERS = 1
+try:
+    WORKERS = int(os.environ.get("WORKERS", WORKERS))
+except:
+    pass
+
+# RENDERER=events evaluates the chip only where the output changes instead of on every sample
+RENDERER = os.environ.get("RENDERER", "samples")
+
+if __name__ == "__main__":
+    from record import VGM_FILENAME, MAX_TIME, LOOP
+
+    wave_file = [f"../output/{os.path.basename(VGM_FILENAME).rstrip('.vgm')}.{ch}.wav" for ch in STEM_NAMES]
+    print(VGM_FILENAME, "->", wave_file)
+
+    start = time.time()
+    stems, playback_rate, clock_rate = render_vgm(VGM_FILENAME, max_time=MAX_TIME, loop=LOOP, workers=WORKERS, renderer=RENDERER)
+    elapsed = time.time() - start
+
+    seconds = stems.shape[1] / 44100
+    print(f"VGM playback rate: {playback_rate}, clock: {clock_rate}")
+    print(f"rendered {seconds:.2f} sec in {elapsed:.2f} sec, {seconds / elapsed:.0f}x faster than real time")
+    for ch, data in enumerate(stems):
+        write(wave_file[ch], 44100, data)
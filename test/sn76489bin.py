@@ -0,0 +1,99 @@
+# Memory mapped reader of .sn76489.bin files, raw register writes of the SN76489 grouped into packets per frame
+#
+# File layout:
+#   header size, playback rate, packets (16 bit little endian), minutes, seconds, ...   header size+1 bytes
+#   title size, title, author size, author
+#   packets: size, register writes                                                      repeated `packets` times
+#   0x00, 0xff                                                                          end of the song
+#
+# The header is parsed once, packet starts are found by pointer doubling over the whole file with NumPy, so no Python
+# loop runs per packet. Packets are returned as memoryview slices of the mapped file without copying:
+#
+#   song = SN76489Bin("../music/MISSION76496.bbc50hz.sn76489.bin")
+#   song.playback_rate, len(song), song.title
+#   song[1000]          # register writes of the frame 1000 as memoryview
+#   for packet in song: ...
+#   song.close()        # or use it as a context manager: with SN76489Bin(filename) as song: ...
+
+import mmap
+import numpy as np
+
+class SN76489Bin:
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, mode="rb") as f:
+            self.file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data = memoryview(self.file)
+        data = self.data
+
+        self.header_size = data[0]
+        self.playback_rate = data[1]
+        self.packets = data[2] + 256*data[3]
+        self.minutes = data[4]
+        self.seconds = data[5]
+        offset = self.header_size + 1
+        self.title = bytes(data[offset + 1: offset + 1 + data[offset]])
+        offset += data[offset] + 1
+        self.author = bytes(data[offset + 1: offset + 1 + data[offset]])
+        offset += data[offset] + 1
+
+        self.offsets = self.index(np.frombuffer(self.file, dtype=np.uint8), offset, self.packets)
+        end = int(self.offsets[-1])
+        assert data[end    ] == 0x00
+        assert data[end + 1] == 0xff
+        self.offsets = self.offsets[:-1] + 1 # first register write of every packet
+        self.sizes = np.frombuffer(self.file, dtype=np.uint8)[self.offsets - 1]
+
+    @staticmethod
+    def index(data, start, packets):
+        # Positions of the size bytes of `packets` packets from `start` followed by the end marker.
+        # Every byte is treated as a size of a potential packet pointing at the next one, packets are the positions
+        # reachable from `start`: after round k `reached` holds the first 2^k of them and `jump` skips 2^k packets
+        # at once, thus the whole chain is found in log2(packets) vectorized rounds.
+        n = len(data)
+        jump = np.minimum(np.arange(n, dtype=np.int64) + data + 1, n)
+        jump = np.append(jump, n) # position n stands for past the end of the file
+        reached = np.zeros(n + 1, dtype=bool)
+        reached[start] = True
+        for _ in range((packets + 1).bit_length()):
+            reached[jump[reached]] = True
+            jump = jump[jump]
+        offsets = np.flatnonzero(reached[:n])[:packets + 1]
+        assert len(offsets) == packets + 1, "file ends before the last packet"
+        return offsets
+
+    def __len__(self):
+        return self.packets
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.packets))]
+        if i < 0:
+            i += self.packets
+        if not 0 <= i < self.packets:
+            raise IndexError("packet index out of range")
+        offset = int(self.offsets[i])
+        return self.data[offset:offset + int(self.sizes[i])]
+
+    def __iter__(self):
+        data = self.data
+        for offset, size in zip(self.offsets.tolist(), self.sizes.tolist()):
+            yield data[offset:offset + size]
+
+    def close(self):
+        # packets still referenced elsewhere keep the mapping alive, it is unmapped once the last of them is released
+        self.data.release()
+        try:
+            self.file.close()
+        except BufferError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        return f"{self.filename}: playback rate: {self.playback_rate} packets: {self.packets} " \
+               f"minutes: {self.minutes} seconds: {self.seconds} title: {self.title} author: {self.author}"
@@ -6,13 +6,6 @@
 */
 module tb ();
 
-  // Dump the signals to a VCD file. You can view it with gtkwave.
-  initial begin
-    $dumpfile("tb.vcd");
-    $dumpvars(0, tb);
-    #1;
-  end
-
   // Wire up the inputs and outputs:
   reg clk;
   reg rst_n;
@@ -34,4 +27,102 @@ module tb ();
       .rst_n  (rst_n)     // not reset
   );
 
+  // Dump the signals to a VCD file. You can view it with gtkwave.
+  // Dumping is controlled with plusargs, see DUMP, DUMP_START and DUMP_STOP in the Makefile:
+  //   +dump=all|top|outputs|none   whole hierarchy (default), testbench signals only, chip outputs only or nothing
+  //   +dump_start=<ms>             start dumping after the given number of milliseconds of simulated time
+  //   +dump_stop=<ms>              stop dumping after the given number of milliseconds of simulated time
+  reg [8*8-1:0] dump_scope;
+  reg [63:0] dump_start;
+  reg [63:0] dump_stop;
+  initial begin
+    if (!$value$plusargs("dump=%s", dump_scope))
+      dump_scope = "all";
+    if (dump_scope != "none") begin
+      $dumpfile("tb.vcd");
+      if (dump_scope == "outputs")
+        $dumpvars(0, clk, rst_n, uo_out, uio_out, uio_oe);
+      else if (dump_scope == "top")
+        $dumpvars(1, tb);
+      else
+        $dumpvars(0, tb);
+
+      if ($value$plusargs("dump_start=%d", dump_start) && dump_start > 0) begin
+        $dumpoff;
+        #(dump_start * 1000000) $dumpon;
+      end
+      if ($value$plusargs("dump_stop=%d", dump_stop)) begin
+        #(dump_stop * 1000000 - $time) $dumpoff;
+        $dumpflush;
+      end
+    end
+    #1;
+  end
+
+  // Comparator for assert_output() in test.py, Python awaits only the edges of output_above
+  reg [7:0] output_threshold;
+  wire output_above = uo_out > output_threshold;
+  initial output_threshold = 0;
+
+  // Sample capture for record.py, enabled from Python by setting capture_enable.
+  // Samples are taken inside the simulator, so Python does not need to wake up for every sample.
+  // Sampling period is tracked with a fractional accumulator: capture_rate (sampling rate) is added
+  // every clock cycle and a sample is taken whenever the accumulator exceeds capture_clock (clock rate).
+  // Values are read before the clock edge, so sample k holds the state after floor(k * capture_clock / capture_rate)
+  // cycles, the same cycle sn76489.sample_cycles() renders in the Python model.
+  // With capture_rate == capture_clock a sample is taken every clock cycle (CAPTURE=full in record.py).
+  // File is flushed only when Python toggles capture_flush before draining it, not on every sample.
+  // Every sample is appended to "capture.bin" as two 32 bit words:
+  //   {3'b0, uio_out[7], chan[1].out, chan[0].out, uo_out} and {12'b0, chan[3].out, chan[2].out}
+  // where uio_out[7] is the PDM output of the master volume
+  reg capture_enable;
+  reg [31:0] capture_rate;
+  reg [31:0] capture_clock;
+  reg [31:0] capture_phase;
+  reg capture_flush;
+  integer capture_file;
+  initial begin
+    capture_enable = 0;
+    capture_phase = 0;
+    capture_flush = 0;
+  end
+
+  wire [9:0] capture_volumes [3:0];
+`ifdef GL_TEST
+  // channel volumes are not accessible in the gate level netlist
+  assign capture_volumes[0] = 0;
+  assign capture_volumes[1] = 0;
+  assign capture_volumes[2] = 0;
+  assign capture_volumes[3] = 0;
+`else
+  assign capture_volumes[0] = tt_um_rejunity_sn76489_uut.chan[0].attenuation.out;
+  assign capture_volumes[1] = tt_um_rejunity_sn76489_uut.chan[1].attenuation.out;
+  assign capture_volumes[2] = tt_um_rejunity_sn76489_uut.chan[2].attenuation.out;
+  assign capture_volumes[3] = tt_um_rejunity_sn76489_uut.chan[3].attenuation.out;
+`endif
+
+  // +capture_file=<filename> overrides the name of the capture file, see CAPTURE_FILE in the Makefile
+  reg [8*1024-1:0] capture_filename; // up to 1024 characters, long enough for absolute paths
+  always @(posedge capture_enable) begin
+    if (!$value$plusargs("capture_file=%s", capture_filename))
+      capture_filename = "capture.bin";
+    capture_file = $fopen(capture_filename, "wb");
+  end
+
+  always @(posedge clk) begin
+    if (capture_enable) begin
+      if (capture_phase + capture_rate > capture_clock) begin
+        capture_phase <= capture_phase + capture_rate - capture_clock;
+        $fwrite(capture_file, "%u", {3'b0, uio_out[7], capture_volumes[1], capture_volumes[0], uo_out});
+        $fwrite(capture_file, "%u", {12'b0, capture_volumes[3], capture_volumes[2]});
+      end else
+        capture_phase <= capture_phase + capture_rate;
+    end
+  end
+
+  always @(capture_flush) begin
+    if (capture_enable)
+      $fflush(capture_file);
+  end
+
 endmodule
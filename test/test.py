@@ -10,6 +10,9 @@
 #   make                    :: run with default parameters
 #   make SEL=1              :: run without clock divider, fastest!
 #   make MASTER_CLOCK=3579545 :: run tests with chip clocked at NTSC frequency
+#
+#   MEASURE=poll            :: measure output frequency by polling uo_out every few clocks instead of awaiting its edges
+#   LOG_WRITES=1            :: print chip state after every register write
 
 # Useful helper functions to communicate with the chip under simulation
 #   await reset(dut)
@@ -17,12 +20,15 @@
 #   await set_tone(dut, channel=0, frequency=440)
 #   await set_noise(dut, white=True, divider=512)
 #   await write(dut, data=1111_0000)              # write data directly on the data bus of the chip, holds /WE low
+#   await write_program(dut, tone_program(0, period=254) + volume_program(0, vol=15))  # batch of writes
 
 
 import os
 import cocotb
 from cocotb.clock import Clock
-from cocotb.triggers import RisingEdge, FallingEdge, Timer, ClockCycles
+from cocotb.triggers import RisingEdge, FallingEdge, Timer, ClockCycles, Edge, ReadOnly
+import registers
+import chiptrace
 
 # MASTER_CLOCK = 3_579_545 # NTSC frequency of SN as used in Sega Master System,    0xFE = 440 Hz
 # MASTER_CLOCK = 3_546_895 # PAL                 ---- // ----
@@ -360,6 +366,14 @@ elif SEL == 2 or SEL == "2" or SEL == "10":
     MASTER_CLOCK = 32_000_000
     CHIP_INTERNAL_CLOCK_DIV = 128
 
+MEASURE = os.environ.get("MEASURE", "edges")
+
+LOG_WRITES = 0
+try:
+    LOG_WRITES = int(os.environ.get("LOG_WRITES", LOG_WRITES))
+except:
+    pass
+
 if SEL == 0 or SEL == "":
     try:
         MASTER_CLOCK = int(os.environ.get("MASTER_CLOCK", MASTER_CLOCK))
@@ -377,32 +391,7 @@ MAX_MASTER_VOLUME = 255
 MAX_CHANNEL_VOLUME = MAX_MASTER_VOLUME/4
 
 def print_chip_state(dut):
-    try:
-        internal = dut.tt_um_rejunity_sn76489_uut
-        print(
-            "W" if dut.uio_in.value & 1 == 0 else " ",
-            dut.ui_in.value, ">||",
-            '{:1d}'.format(int(internal.latch_control_reg.value)), "!",
-            '{:4d}'.format(int(internal.tone[0].gen.compare.value)),
-            '{:4d}'.format(int(internal.tone[0].gen.counter.value)),
-                        "|#|" if internal.tone[0].gen.out == 1 else "|-|", # "|",
-            '{:4d}'.format(int(internal.tone[1].gen.compare.value)),
-            '{:4d}'.format(int(internal.tone[1].gen.counter.value)),
-                        "|#|" if internal.tone[1].gen.out == 1 else "|-|",  #"|",
-            '{:4d}'.format(int(internal.tone[2].gen.compare.value)),
-            '{:4d}'.format(int(internal.tone[2].gen.counter.value)),
-                        "|#|" if internal.tone[2].gen.out == 1 else "|-|",  #"!",
-            "R" if internal.noise[0].gen.reset_lfsr == 1 else " ",
-            "w" if internal.noise[0].gen.is_white_noise == 1 else "p",
-            ["16", "32", "64", "T3"][internal.noise[0].gen.control.value & 3],
-            '{:3d}'.format(int(internal.noise[0].gen.counter)),
-            internal.noise[0].gen.trigger.value,
-            ">" if internal.noise[0].gen.trigger_edge == 1 else " ",
-            internal.noise[0].gen.lfsr.value, ">>",
-            '{:3d}'.format(int(dut.uo_out.value >> 1)),
-                        "@" if dut.uo_out[0].value == 1 else ".")
-    except:
-       print(dut.ui_in.value, ">", dut.uo_out.value)
+    chiptrace.print_chip_state(dut, cycle_in_nanoseconds=1e9 // MASTER_CLOCK)
 
 # 0b1111_1111
 INPUT_ON_RESET          = 0
@@ -480,16 +469,39 @@ def channel_index(channel):
     return channel
 
 
+async def write_program(dut, program):
+    # writes all bytes of the program on consecutive clock cycles, then holds /WE high for one clock cycle
+    await registers.write_program(dut, program, WRITE_ENABLED, WRITE_DISABLED,
+                                  log=print_chip_state if LOG_WRITES else None)
+
 async def write(dut, data):
     dut.uio_in.value = WRITE_ENABLED
     dut.ui_in.value = data
     await ClockCycles(dut.clk, 1)
-    print_chip_state(dut)
+    if LOG_WRITES: print_chip_state(dut)
 
 async def flush(dut):
     dut.uio_in.value = WRITE_DISABLED
     await ClockCycles(dut.clk, 1)
-    print_chip_state(dut)
+    if LOG_WRITES: print_chip_state(dut)
+
+def tone_program(channel, period):
+    if CHIP_INTERNAL_CLOCK_DIV == 1:
+        # never set frequency to 0 when chip is running without a clock divider
+        # when chip has no clock divider, the internal counter will starts counting down immediately
+        # and wrap around to 0x3ff period!
+        return [CMD_FREQUENCY | (channel << 5) | ((period | 1) & 15),
+                period >> 4,
+                CMD_FREQUENCY | (channel << 5) | (period & 15)]
+    else:
+        return [CMD_FREQUENCY | (channel << 5) | (period & 15),
+                period >> 4]
+
+def noise_program(white, noise_control):
+    return [CMD_NOISE | (white << 2) | noise_control]
+
+def volume_program(channel, vol):
+    return [CMD_ATTENUATOR | (channel << 5) | (15 - vol)]
 
 async def set_tone(dut, channel, frequency=-1, period=-1):
     channel = channel_index(channel)
@@ -497,22 +509,11 @@ async def set_tone(dut, channel, frequency=-1, period=-1):
         period = MASTER_CLOCK // (CHIP_INTERNAL_CLOCK_DIV * 2 * frequency)
     assert 0 <= channel and channel <= 3
     assert 0 <= period and period <= 1023
-    if CHIP_INTERNAL_CLOCK_DIV == 1:
-        # never set frequency to 0 when chip is running without a clock divider
-        # when chip has no clock divider, the internal counter will starts counting down immediately
-        # and wrap around to 0x3ff period!
-        await write(dut, CMD_FREQUENCY | (channel << 5) | ((period | 1) & 15))
-        await write(dut, period >> 4)
-        await write(dut, CMD_FREQUENCY | (channel << 5) | (period & 15))
-    else:
-        await write(dut, CMD_FREQUENCY | (channel << 5) | (period & 15))
-        await write(dut, period >> 4)
-    await flush(dut)
+    await write_program(dut, tone_program(channel, period))
 
 async def set_noise_via_tone3(dut, white=True):
     white = 1 if white else 0
-    await write(dut, CMD_NOISE | (white << 2) | 0b11)
-    await flush(dut)
+    await write_program(dut, noise_program(white, 0b11))
 
 async def set_noise(dut, white=True, frequency=-1, period=-1, divider=-1):
     white = 1 if white else 0
@@ -528,20 +529,62 @@ async def set_noise(dut, white=True, frequency=-1, period=-1, divider=-1):
     elif divider == 2 or divider == 64 * CHIP_INTERNAL_CLOCK_DIV * 2 or period == 64:
         noise_control = 2
     assert 0 <= noise_control and noise_control < 3
-    await write(dut, CMD_NOISE | (white << 2) | noise_control)
-    await flush(dut)
+    await write_program(dut, noise_program(white, noise_control))
 
 async def set_silence(dut):
-    for ch in range(4):
-        await set_volume(dut, ch, 0)
+    await write_program(dut, [data for ch in range(4) for data in volume_program(ch, 0)])
 
 async def set_volume(dut, channel, vol=0):
     channel = channel_index(channel)
     assert 0 <= channel and channel <= 3
     assert 0 <= vol     and vol <= 15
-    print(channel, vol)
-    await write(dut, CMD_ATTENUATOR | (channel << 5) | (15 - vol))
-    await flush(dut)
+    if LOG_WRITES: print(channel, vol)
+    await write_program(dut, volume_program(channel, vol))
+
+async def count_state_changes_by_polling(dut, cycles_to_collect_data, mid_volume):
+    state_changes = 0
+    clocks_to_step = CHIP_INTERNAL_CLOCK_DIV//2 if CHIP_INTERNAL_CLOCK_DIV >= 2 and CHIP_INTERNAL_CLOCK_DIV%2 == 0 else 1
+    for i in range(cycles_to_collect_data//clocks_to_step):
+        last_state = get_output(dut) > mid_volume
+        await ClockCycles(dut.clk, clocks_to_step)
+        # print_chip_state(dut)
+        new_state = get_output(dut) > mid_volume
+        if last_state != new_state:
+            state_changes += 1
+    return state_changes
+
+async def record_output_edges(dut, edges):
+    # appends (time in ns, new state) of the initial state and then whenever uo_out crosses the output_threshold of tb.v
+    await ReadOnly()
+    state = int(dut.output_above.value)
+    edges.append((cocotb.utils.get_sim_time("ns"), state))
+    while True:
+        await Edge(dut.output_above)
+        await ReadOnly() # combinational sum of the channels might glitch, compare only the settled value
+        if int(dut.output_above.value) != state:
+            state ^= 1
+            edges.append((cocotb.utils.get_sim_time("ns"), state))
+
+async def count_state_changes_on_edges(dut, cycles_to_collect_data, mid_volume):
+    # Python wakes up only when the output crosses the threshold, instead of every few clocks.
+    # Returns number of state changes and duty cycle (fraction of time above threshold) within the window.
+    dut.output_threshold.value = int(mid_volume)
+    cycle_in_nanoseconds = 1e9 // MASTER_CLOCK
+    window = cycles_to_collect_data * cycle_in_nanoseconds
+    start = cocotb.utils.get_sim_time("ns")
+
+    edges = []
+    recorder = cocotb.start_soon(record_output_edges(dut, edges))
+    await Timer(window, units="ns")
+    await FallingEdge(dut.clk) # edges exactly at the end of the window are recorded by now
+    recorder.kill()
+
+    (since, state), edges = edges[0], [(time, state) for time, state in edges[1:] if time <= start + window]
+    time_above = 0
+    for time, new_state in edges + [(start + window, None)]:
+        time_above += (time - since) if state else 0
+        state, since = new_state, time
+    return len(edges), time_above / window
 
 async def assert_output(dut, frequency=-1, period=-1, constant=False, noise=False, v0 = ZERO_VOLUME, v1 = MAX_CHANNEL_VOLUME):
     if frequency > 0:
@@ -559,15 +602,11 @@ async def assert_output(dut, frequency=-1, period=-1, constant=False, noise=Fals
         cycles_to_collect_data *= pulses_to_collect * 2
 
     mid_volume = (v0 + v1) // 2
-    state_changes = 0
-    clocks_to_step = CHIP_INTERNAL_CLOCK_DIV//2 if CHIP_INTERNAL_CLOCK_DIV >= 2 and CHIP_INTERNAL_CLOCK_DIV%2 == 0 else 1
-    for i in range(cycles_to_collect_data//clocks_to_step):
-        last_state = get_output(dut) > mid_volume
-        await ClockCycles(dut.clk, clocks_to_step)
-        # print_chip_state(dut)
-        new_state = get_output(dut) > mid_volume
-        if last_state != new_state:
-            state_changes += 1
+    if MEASURE == "poll":
+        state_changes = await count_state_changes_by_polling(dut, cycles_to_collect_data, mid_volume)
+        duty_cycle = None
+    else:
+        state_changes, duty_cycle = await count_state_changes_on_edges(dut, cycles_to_collect_data, mid_volume)
 
     time_passed_to_collect_data = cycles_to_collect_data / MASTER_CLOCK
     measured_frequency = (state_changes / 2) / time_passed_to_collect_data
@@ -579,6 +618,8 @@ async def assert_output(dut, frequency=-1, period=-1, constant=False, noise=Fals
             dut._log.info(f"expected {noise} frequency {frequency/1000:4.3f} KHz and measured {measured_frequency/1000:4.3f} KHz")
         else:
             dut._log.info(f"expected {noise} frequency {frequency:3.2f} Hz and measured {measured_frequency:3.2f} Hz")
+        if duty_cycle is not None:
+            dut._log.info(f"measured duty cycle {duty_cycle*100:3.1f}%")
         assert frequency * (1.0-max_error) <= measured_frequency and measured_frequency <= frequency * (1.0+max_error)
 
     pulses_to_collect2 = pulses_to_collect*2
@@ -0,0 +1,102 @@
+# Binary trace records of chiptrace.py are written and read back without a simulator, signals are faked
+from types import SimpleNamespace
+import numpy as np
+import chiptrace
+from chiptrace import RECORD, ChipTrace, format_record, read_trace, print_chip_state
+
+def test_trace_file_round_trip(tmp_path):
+    records = np.zeros(3, dtype=RECORD)
+    records['cycle'] = [10, 11, 1 << 40]
+    records['valid'] = [1, 1, 0]
+    records['write_enabled'] = [1, 0, 0]
+    records['ui_in'] = [0b1000_0001, 0, 0xff]
+    records['compare'][0] = [254, 1023, 1]
+    records['lfsr'][0] = 0x4000
+    records['uo_out'] = [0b1010_1011, 0, 0x80]
+    filename = tmp_path / "song.trace.bin"
+    records.tofile(filename)
+    assert np.array_equal(read_trace(filename), records)
+
+def test_format_record():
+    record = np.zeros(1, dtype=RECORD)[0]
+    record['cycle'] = 42
+    record['valid'] = 1
+    record['write_enabled'] = 1
+    record['ui_in'] = 0b1000_0001
+    record['compare'] = [254, 0, 0]
+    record['out'] = [1, 0, 0]
+    record['white_noise'] = 1
+    record['noise_control'] = 3
+    record['lfsr'] = 0x4000
+    record['uo_out'] = 0b1010_1011
+    line = format_record(record)
+    assert line.split()[:3] == ["42", "W", "10000001"]
+    assert " 254    0 |#|" in line and "|-|" in line
+    assert " w T3 " in line and "100000000000000" in line
+    assert line.endswith(" 85 @")
+
+    record['valid'] = 0 # gate level simulation, internals are not traced
+    assert format_record(record) == "      42 10000001 > 10101011"
+
+class Signal:
+    def __init__(self, value):
+        self.value = value
+
+def fake_dut(internals=True):
+    # handles named as in tb.v, values are plain ints just like LogicArray converted by int()
+    dut = SimpleNamespace(ui_in=Signal(0b1000_0001), uio_in=Signal(0b11111_01_0), uo_out=Signal(0b1010_1011))
+    if internals:
+        gen = lambda i: SimpleNamespace(compare=Signal(100 + i), counter=Signal(i), out=Signal(i & 1))
+        noise = SimpleNamespace(reset_lfsr=Signal(1), is_white_noise=Signal(1), control=Signal(3), counter=Signal(7),
+                                trigger=Signal(1), trigger_edge=Signal(0), lfsr=Signal(0x4000))
+        dut.tt_um_rejunity_sn76489_uut = SimpleNamespace(latch_control_reg=Signal(2),
+            tone=[SimpleNamespace(gen=gen(i)) for i in range(3)], noise=[SimpleNamespace(gen=noise)])
+    return dut
+
+def test_trace_records_flushed_in_chunks(tmp_path, monkeypatch):
+    time = iter(range(0, 1000, 250))
+    monkeypatch.setattr(chiptrace.cocotb.utils, "get_sim_time", lambda units: next(time))
+    dut = fake_dut()
+    filename = tmp_path / "song.trace.bin"
+    trace = ChipTrace(dut, filename, cycle_in_nanoseconds=250, chunk_size=2)
+    trace(dut)
+    trace(dut)
+    assert len(read_trace(filename)) == 0 # buffer is full, but written only once the next record comes
+    dut.uo_out.value = 0
+    dut.uio_in.value = 0b11111_01_1
+    trace(dut)
+    assert len(read_trace(filename)) == 2
+    trace.close()
+
+    records = read_trace(filename)
+    assert records['cycle'].tolist() == [0, 1, 2]
+    assert records['valid'].tolist() == [1, 1, 1]
+    assert records['write_enabled'].tolist() == [1, 1, 0]
+    assert records['uo_out'].tolist() == [0b1010_1011, 0b1010_1011, 0]
+    assert records['compare'][0].tolist() == [100, 101, 102]
+    assert records['counter'][0].tolist() == [0, 1, 2]
+    assert records['out'][0].tolist() == [0, 1, 0]
+    assert records[0]['latch'] == 2 and records[0]['noise_control'] == 3 and records[0]['noise_counter'] == 7
+    assert records[0]['reset_lfsr'] == 1 and records[0]['trigger_edge'] == 0 and records[0]['lfsr'] == 0x4000
+
+def test_trace_without_internals(tmp_path, monkeypatch):
+    monkeypatch.setattr(chiptrace.cocotb.utils, "get_sim_time", lambda units: 42)
+    dut = fake_dut(internals=False) # gate level netlist
+    trace = ChipTrace(dut, tmp_path / "gates.trace.bin")
+    assert trace.internal is None
+    trace(dut)
+    dut.uo_out.value = "x" # undefined value
+    trace(dut)
+    trace.close()
+    records = read_trace(tmp_path / "gates.trace.bin")
+    assert records['valid'].tolist() == [0, 0]
+    assert format_record(records[0]) == "      42 10000001 > 10101011"
+
+def test_print_chip_state(monkeypatch, capsys):
+    monkeypatch.setattr(chiptrace.cocotb.utils, "get_sim_time", lambda units: 500)
+    dut = fake_dut()
+    print_chip_state(dut, cycle_in_nanoseconds=250)
+    print_chip_state(dut, cycle_in_nanoseconds=100)
+    lines = capsys.readouterr().out.splitlines()
+    assert [line.split()[0] for line in lines] == ["2", "5"]
+    assert lines[0].endswith(" 85 @")
@@ -0,0 +1,46 @@
+# LFSR tables and jump-ahead of lfsr.py against shifting the register one step at a time
+import pytest
+from lfsr import LFSR, VARIANTS
+
+# periods from src/noise.v taps: white noise of the 15 bit variants repeats after 2^15-1 shifts, SMS after 57337
+PERIODS = {'bbc': 32767, 'sms': 57337, 'tandy': 32767}
+
+def stepped(lfsr, state, shifts, white):
+    for _ in range(shifts):
+        state = lfsr.step(state, white)
+    return state
+
+@pytest.mark.parametrize("name", VARIANTS)
+def test_white_noise_period(name):
+    lfsr = LFSR.variant(name)
+    assert lfsr.period(white=True) == PERIODS[name]
+    assert stepped(lfsr, lfsr.reset_state, PERIODS[name], True) == lfsr.reset_state
+
+@pytest.mark.parametrize("name", VARIANTS)
+@pytest.mark.parametrize("white", [True, False])
+def test_sequence_matches_stepping(name, white):
+    lfsr = LFSR.variant(name)
+    state = lfsr.reset_state
+    expected = []
+    for _ in range(2000):
+        expected.append(state & 1)
+        state = lfsr.step(state, white)
+    assert lfsr.output(lfsr.reset_state, 2000, white).tolist() == expected
+
+@pytest.mark.parametrize("name", VARIANTS)
+@pytest.mark.parametrize("white", [True, False])
+@pytest.mark.parametrize("shifts", [0, 1, 14, 15, 16, 1000, 32767, 100_003])
+def test_jump_matches_stepping(name, white, shifts):
+    lfsr = LFSR.variant(name)
+    state = stepped(lfsr, lfsr.reset_state, 123, white) # somewhere in the middle of the sequence
+    expected = stepped(lfsr, state, shifts, white)
+    assert lfsr.jump(state, shifts, white) == expected
+    assert lfsr.jump_matrix(state, shifts, white) == expected
+
+@pytest.mark.parametrize("state", [0, 0b101, 0x7fff])
+def test_jump_outside_of_the_sequence(state):
+    # e.g. all zeros is not part of any sequence, matrix power is used instead of the tables
+    lfsr = LFSR.variant('bbc')
+    for white in [True, False]:
+        assert lfsr.jump(state, 777, white) == stepped(lfsr, state, 777, white)
+        assert lfsr.output(state, 40, white).tolist() == [stepped(lfsr, state, k, white) & 1 for k in range(40)]
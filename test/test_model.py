@@ -0,0 +1,106 @@
+# Compares the NumPy model of the chip (sn76489.py) against RTL simulation bit for bit.
+# A short slice of a VGM is played into RTL the same way record.py does (SEL=1, samples taken by tb.v)
+# and rendered by the model with render_segment(), master output and all 4 channel volumes must match on every sample.
+# The second test seeks into the middle of the slice from a checkpoint of the model, as record.py does for START_TIME.
+#
+# How to run this script from command line:
+#
+# make MODULE=test_model
+#
+# Other song or a longer slice (in seconds), the slice is kept short since RTL runs at about real time:
+#
+# make MODULE=test_model VGM=../music/CrazeeRider-title.bbc50hz.vgm MAX_TIME=2
+#
+
+import os
+import numpy as np
+import cocotb
+from cocotb.clock import Clock
+from cocotb.triggers import ClockCycles, FallingEdge
+from registers import write_program
+import record
+import sn76489
+
+VGM_FILENAME = os.environ.get("VGM", "../music/MISSION76496.bbc50hz.vgm")
+
+MAX_TIME = 1
+try:
+    MAX_TIME = int(os.environ.get("MAX_TIME", MAX_TIME))
+except:
+    pass
+
+SAMPLING_RATE = 44100
+
+WRITE_ENABLED  = 0b11111_01_0 # SEL = 1 :: no clock div ; /WE = 0 :: writes enabled
+WRITE_DISABLED = 0b11111_01_1 # SEL = 1 :: no clock div ; /WE = 1 :: writes disabled
+
+async def play(dut, music, playback_rate, clock_rate, cycles, first=0, checkpoint=None):
+    # Plays frames from `first` on into RTL with the same setup as record.py::play_and_record_wav,
+    # starting from `checkpoint` if given. Returns raw values captured by tb.v on the `cycles` of the model.
+    clock = Clock(dut.clk, round(1e12 * 16 / clock_rate), units="ps")
+    cocotb.start_soon(clock.start())
+    dut.ui_in.value = 0
+    dut.uio_in.value = WRITE_DISABLED
+    dut.rst_n.value = 0
+    await ClockCycles(dut.clk, 10)
+    dut.rst_n.value = 1
+
+    cycle = sn76489.frame_cycle(first, playback_rate, clock_rate)
+    capture_rate = SAMPLING_RATE * 16
+    if checkpoint is not None:
+        await FallingEdge(dut.clk)
+        record.ChipState(dut).write(checkpoint)
+    dut.capture_phase.value = sn76489.capture_phase(cycle, capture_rate, clock_rate) # left over from a previous test
+    capture = record.HDLCapture(dut, capture_rate, clock_rate)
+
+    for index, frame in enumerate(music, start=first):
+        if len(frame) == 0:
+            continue
+        frame_start = sn76489.frame_cycle(index, playback_rate, clock_rate)
+        if frame_start > cycle:
+            await ClockCycles(dut.clk, frame_start - cycle)
+            cycle = frame_start
+        await write_program(dut, frame, WRITE_ENABLED, WRITE_DISABLED, flush=False)
+        cycle += len(frame)
+    await ClockCycles(dut.clk, max(int(cycles[-1]) - cycle, 0) + 2)
+    captured = (await capture.close()).astype(np.int32)
+    assert captured.shape[1] >= len(cycles), f"RTL captured {captured.shape[1]} samples, model rendered {len(cycles)}"
+    return captured[:, :len(cycles)]
+
+def assert_matches(captured, expected, cycles, clock_rate):
+    expected = expected.copy()
+    expected[0] >>= 7 # model returns uo_out << 7, see sn76489.mix()
+    mismatch = np.flatnonzero(np.any(captured != expected, axis=0))
+    if len(mismatch) == 0:
+        return
+    # samples due exactly on a clock edge point at the alignment of the capture, see capture_phase in tb.v
+    on_edge = (cycles[mismatch] * 16 * SAMPLING_RATE) % clock_rate == 0
+    first = mismatch[0]
+    raise AssertionError(
+        f"{len(mismatch)} of {len(cycles)} samples differ ({np.count_nonzero(on_edge)} due exactly on a clock edge), "
+        f"first at sample {first} (cycle {cycles[first]}): "
+        f"RTL {captured[:, first].tolist()} vs model {expected[:, first].tolist()}")
+
+@cocotb.test()
+async def test_model_matches_rtl(dut):
+    music, playback_rate, clock_rate = record.load_vgm(VGM_FILENAME)
+    cycles = sn76489.sample_cycles(len(music), playback_rate, clock_rate, MAX_TIME, SAMPLING_RATE)
+    frames = sn76489.frames_to_render(music, playback_rate, clock_rate, cycles)
+    expected, _ = sn76489.render_segment(music[:frames], playback_rate, clock_rate, cycles)
+
+    captured = await play(dut, music[:frames], playback_rate, clock_rate, cycles)
+    assert_matches(captured, expected, cycles, clock_rate)
+
+@cocotb.test()
+async def test_model_matches_rtl_after_seek(dut):
+    music, playback_rate, clock_rate = record.load_vgm(VGM_FILENAME)
+    cycles = sn76489.sample_cycles(len(music), playback_rate, clock_rate, MAX_TIME, SAMPLING_RATE)
+    frames = sn76489.frames_to_render(music, playback_rate, clock_rate, cycles)
+    first = frames // 2
+    checkpoint, = sn76489.checkpoints(music, playback_rate, clock_rate, [first])
+    cycles = cycles[cycles >= sn76489.frame_cycle(first, playback_rate, clock_rate)]
+    expected, _ = sn76489.render_segment(music[first:frames], playback_rate, clock_rate, cycles,
+                                         first=first, state=checkpoint)
+
+    captured = await play(dut, music[first:frames], playback_rate, clock_rate, cycles, first, checkpoint)
+    assert_matches(captured, expected, cycles, clock_rate)
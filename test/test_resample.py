@@ -0,0 +1,60 @@
+# resample.Decimator against a plain polyphase reference built with scipy, and its streaming against a single chunk
+import numpy as np
+import pytest
+from scipy.signal import firwin
+from resample import Decimator
+
+# 223721 Hz is the NTSC clock 3579545/16, coprime to 44100, thus it has 44100 phases and is slow to set up
+RATES = [(250_000, 44100), (250_000, 48000), (223_721, 44100), (48000, 48000)]
+STREAMING_RATES = [(250_000, 44100), (250_000, 48000), (48000, 48000)]
+
+def reference(x, decimator, input_rate, output_rate, zero_crossings=16, passband=0.9, beta=8.6):
+    # same prototype by scipy.signal.firwin, every phase scaled to unit DC gain,
+    # output n is the upsampled and filtered signal at position n*M + shift
+    up, down = decimator.up, decimator.down
+    ratio = max(1.0, input_rate / output_rate)
+    taps = int(np.ceil(2 * zero_crossings * ratio))
+    length = taps * up
+    prototype = firwin(length, passband / (up * ratio), window=('kaiser', beta), scale=False)
+    for phase in range(up):
+        prototype[phase::up] /= prototype[phase::up].sum()
+    outputs = decimator.available(x.shape[1])
+    y = np.zeros((x.shape[0], outputs))
+    for n in range(outputs):
+        position = n * down + length // 2
+        k = np.arange(position // up - taps + 1, position // up + 1) # input samples under the filter
+        valid = k >= 0
+        y[:, n] = x[:, k[valid]] @ prototype[position - k[valid] * up]
+    return y
+
+@pytest.mark.parametrize("input_rate, output_rate", RATES)
+def test_matches_reference(input_rate, output_rate):
+    x = np.random.default_rng(1).integers(0, 1024, size=(2, 3000)).astype(np.float64)
+    decimator = Decimator(input_rate, output_rate, channels=2)
+    y = decimator.process(x)
+    assert y.shape[1] == decimator.available(x.shape[1])
+    assert np.allclose(y, reference(x, decimator, input_rate, output_rate), atol=1e-2)
+
+@pytest.mark.parametrize("input_rate, output_rate", STREAMING_RATES)
+def test_streaming_matches_single_chunk(input_rate, output_rate):
+    x = np.random.default_rng(2).integers(0, 1024, size=(3, 20000)).astype(np.float32)
+    whole = Decimator(input_rate, output_rate, channels=3)
+    expected = np.concatenate([whole.process(x), whole.flush()], axis=1)
+
+    streamed = Decimator(input_rate, output_rate, channels=3)
+    bounds = [0] + sorted(np.random.default_rng(3).integers(0, x.shape[1], size=30).tolist()) + [x.shape[1]]
+    chunks = [streamed.process(x[:, start:end]) for start, end in zip(bounds[:-1], bounds[1:])] + [streamed.flush()]
+    assert np.allclose(np.concatenate(chunks, axis=1), expected, atol=1e-2)
+    assert expected.shape[1] == -(-x.shape[1] * output_rate // input_rate)
+
+def test_constant_level_passes_unchanged():
+    decimator = Decimator(250_000, 44100, channels=1)
+    y = np.concatenate([decimator.process(np.full((1, 50000), 700.0)), decimator.flush()], axis=1)
+    assert np.allclose(y[:, decimator.taps:], 700.0, atol=1e-2)
+
+def test_tone_above_nyquist_is_removed():
+    # 30 kHz would alias to 14.1 kHz at 44.1 kHz without the low-pass filter
+    t = np.arange(100_000) / 250_000
+    decimator = Decimator(250_000, 44100, channels=1)
+    y = decimator.process(np.sin(2 * np.pi * 30_000 * t)[None, :])
+    assert np.abs(y[:, decimator.taps:]).max() < 1e-3
@@ -0,0 +1,42 @@
+# Sampling instants of the Python model (sn76489.py) against the capture accumulator of tb.v, without a simulator
+import numpy as np
+import pytest
+import sn76489
+
+def tb_capture_cycles(samples, capture_rate, capture_clock, first_cycle=0):
+    # Same as the capture block in tb.v: on every clock edge capture_rate is added to capture_phase and a sample
+    # is taken once it exceeds capture_clock. Values are read before the edge, so the sample taken on the edge n
+    # holds the state after n-1 cycles. capture_phase is seeded by record.py when it seeks to `first_cycle`.
+    phase = sn76489.capture_phase(first_cycle, capture_rate, capture_clock)
+    cycles = []
+    cycle = first_cycle
+    while len(cycles) < samples:
+        if phase + capture_rate > capture_clock:
+            phase += capture_rate - capture_clock
+            cycles.append(cycle)
+        else:
+            phase += capture_rate
+        cycle += 1
+    return np.array(cycles, dtype=np.int64)
+
+@pytest.mark.parametrize("clock_rate", [4_000_000, 3_579_545, 3_546_895])
+@pytest.mark.parametrize("sampling_rate", [44100, 48000])
+def test_sample_cycles_match_tb_capture(clock_rate, sampling_rate):
+    cycles = sn76489.sample_cycles(50, 50, clock_rate, max_time=0.2, sampling_rate=sampling_rate)
+    assert len(cycles) == sampling_rate // 5
+    # at 4 MHz and 44.1 kHz every 441st sample falls exactly on a clock cycle
+    assert np.array_equal(tb_capture_cycles(len(cycles), sampling_rate * 16, clock_rate), cycles)
+
+def test_seeked_capture_continues_on_sample_cycles():
+    clock_rate, sampling_rate = 4_000_000, 44100
+    cycles = sn76489.sample_cycles(50, 50, clock_rate, max_time=0.2, sampling_rate=sampling_rate)
+    # frames of 50 Hz start exactly on a sample at 4 MHz and 44.1 kHz, that sample must not be skipped
+    for first_cycle in [sn76489.frame_cycle(n, 50, clock_rate) for n in [1, 3, 7]] + [int(cycles[440]) + 1]:
+        expected = cycles[cycles >= first_cycle]
+        captured = tb_capture_cycles(len(expected), sampling_rate * 16, clock_rate, first_cycle)
+        assert np.array_equal(captured, expected)
+
+def test_full_capture_samples_every_cycle():
+    # CAPTURE=full: capture_rate == capture_clock, sample k holds the state after k cycles, also after a seek
+    assert np.array_equal(tb_capture_cycles(5, 1000, 1000), [1, 2, 3, 4, 5])
+    assert np.array_equal(tb_capture_cycles(5, 1000, 1000, first_cycle=10), [10, 11, 12, 13, 14])
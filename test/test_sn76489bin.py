@@ -0,0 +1,54 @@
+# Packets of sn76489bin.SN76489Bin against a straightforward reader of .sn76489.bin files as it was in record.py
+import glob
+import os
+import pytest
+from sn76489bin import SN76489Bin
+
+MUSIC_DIR = os.path.join(os.path.dirname(__file__), "../music")
+SONGS = sorted(glob.glob(os.path.join(MUSIC_DIR, "*.sn76489.bin")))
+
+def load_reference(filename):
+    data = open(filename, mode="rb").read()
+    playback_rate = data[1]
+    packets = data[2] + 256*data[3]
+    offset = data[0] + 1
+    title = data[offset + 1: offset + 1 + data[offset]]
+    offset += data[offset] + 1
+    author = data[offset + 1: offset + 1 + data[offset]]
+    offset += data[offset] + 1
+    jagged = []
+    for i in range(packets):
+        jagged.append(data[offset+1:offset+1+data[offset]])
+        offset += data[offset] + 1
+    assert data[offset:offset+2] == b'\x00\xff'
+    return jagged, playback_rate, title, author
+
+@pytest.mark.parametrize("filename", SONGS, ids=os.path.basename)
+def test_packets_match_reference(filename):
+    jagged, playback_rate, title, author = load_reference(filename)
+    with SN76489Bin(filename) as song:
+        assert (song.playback_rate, song.title, song.author) == (playback_rate, title, author)
+        assert len(song) == len(jagged)
+        assert [bytes(packet) for packet in song] == jagged
+        assert [bytes(song[i]) for i in range(len(song))] == jagged
+        assert bytes(song[-1]) == jagged[-1]
+        assert [bytes(packet) for packet in song[10:20]] == jagged[10:20]
+
+def test_index_out_of_range():
+    with SN76489Bin(SONGS[0]) as song:
+        with pytest.raises(IndexError):
+            song[len(song)]
+
+def test_close_with_packets_alive():
+    song = SN76489Bin(SONGS[0])
+    packet = bytes(song[0])
+    alive = song[0]
+    song.close()
+    assert bytes(alive) == packet
+
+def test_truncated_file(tmp_path):
+    data = open(SONGS[0], mode="rb").read()
+    filename = tmp_path / "truncated.sn76489.bin"
+    filename.write_bytes(data[:len(data) // 2])
+    with pytest.raises(AssertionError):
+        SN76489Bin(str(filename))
@@ -0,0 +1,94 @@
+# Columnar command table and opcode scan of vgmparse.Parser against the command list decoded by parse_commands()
+import glob
+import os
+import struct
+import pytest
+import vgmparse
+
+MUSIC_DIR = os.path.join(os.path.dirname(__file__), "../music")
+SONGS = sorted(glob.glob(os.path.join(MUSIC_DIR, "*.vg[mz]")))
+
+def parse(data):
+    try:
+        return vgmparse.Parser(data)
+    except IndexError:
+        pytest.skip("GD3 of the file can not be parsed")
+
+def waits(command):
+    # samples waited after the command, decoded from the command list
+    opcode = command['command'][0]
+    if opcode == 0x61:
+        return struct.unpack('<H', command['data'])[0]
+    return {0x62: 735, 0x63: 882}.get(opcode, (opcode & 0x0f) + 1 if opcode & 0xf0 == 0x70 else 0)
+
+def check_table(parser):
+    table = parser.parse_command_table()
+    commands = parser.command_list
+    assert len(table['opcode']) == len(commands)
+    sample = 0
+    for opcode, offset, length, time, command in zip(table['opcode'], table['offset'], table['length'], table['sample'],
+                                                     commands):
+        assert bytes([opcode]) == command['command']
+        assert command['data'] is None or isinstance(command['data'], bytes) # not a view into the whole file
+        payload = bytes(table['buffer'][offset:offset + length])
+        assert payload == (bytes(command['data']) if command['data'] is not None else b'')
+        assert time == sample
+        sample += waits(command)
+    assert list(parser.iter_opcodes()) == [(command['command'][0], waits(command)) for command in commands]
+
+@pytest.mark.parametrize("filename", SONGS, ids=os.path.basename)
+def test_table_matches_commands(filename):
+    check_table(parse(filename))
+
+def test_mixed_commands():
+    # dual chip writes, short waits, a data block and a PCM RAM write on top of the header of a bundled song
+    original = open(os.path.join(MUSIC_DIR, "MISSION76496.bbc50hz.vgm"), mode="rb").read()
+    offset = vgmparse.Parser(original, lazy=True).vgm_data_offset
+    gd3 = struct.unpack_from('<I', original, 0x14)[0] + 0x14
+    commands = bytes([
+        0x50, 0x90,                                             # SN76489 write
+        0x30, 0x9f,                                             # second SN76489 write
+        0x75,                                                   # wait 6 samples
+        0x67, 0x66, 0x00, 0x04, 0x00, 0x00, 0x00, 1, 2, 3, 4,   # data block of 4 bytes
+        0x52, 0x28, 0xf0,                                       # YM2612 write
+        0x61, 0x10, 0x00,                                       # wait 16 samples
+        0x68, 0x66, 0x00, 1, 0, 0, 2, 0, 0, 3, 0, 0,            # PCM RAM write
+        0xe0, 0x00, 0x01, 0x00, 0x00,                           # seek PCM
+        0x62, 0x63, 0x7f,
+        0x66,
+    ])
+    data = bytearray(original[:offset] + commands)
+    struct.pack_into('<I', data, 0x14, len(data) - 0x14)
+    data += original[gd3:]
+    struct.pack_into('<I', data, 0x04, len(data) - 4)
+    struct.pack_into('<I', data, 0x1c, 0) # no loop
+    parser = vgmparse.Parser(bytes(data))
+    assert [command['command'][0] for command in parser.command_list] == \
+        [0x50, 0x30, 0x75, 0x52, 0x61, 0x68, 0xe0, 0x62, 0x63, 0x7f, 0x66]
+    assert bytes(parser.data_block) == bytes([1, 2, 3, 4])
+    check_table(parser)
+    assert parser.command_table['sample'][-1] == 6 + 16 + 735 + 882 + 16
+
+def test_close_unmaps_file():
+    filename = os.path.join(MUSIC_DIR, "MISSION76496.bbc50hz.vgm")
+    with vgmparse.Parser(filename) as parser:
+        commands = parser.command_list
+    assert parser.file.closed
+    assert commands == vgmparse.Parser(open(filename, mode="rb").read()).command_list
+
+    with vgmparse.Parser(filename, lazy=True) as parser:
+        table = parser.parse_command_table()
+    assert not parser.file.closed # the command table still points into the mapped file
+    assert bytes(table['buffer'][:4]) == b'Vgm '
+    del table
+    parser.close()
+    assert parser.file.closed
+
+def test_bytes_like_input_is_not_copied():
+    data = bytearray(open(os.path.join(MUSIC_DIR, "MISSION76496.bbc50hz.vgm"), mode="rb").read())
+    reference = vgmparse.Parser(bytes(data)).command_list
+    for source in [data, memoryview(data)]:
+        parser = vgmparse.Parser(source)
+        assert parser.operands.obj is data
+        assert parser.command_list == reference
+        check_table(parser)
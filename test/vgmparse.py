@@ -1,16 +1,138 @@
 import gzip
+import mmap
+import os
 import struct
-import sys
-
-if (sys.version_info > (3, 0)):
-    from io import BytesIO as ByteBuffer
-else:
-    from StringIO import StringIO as ByteBuffer
+from array import array
 
 
 class VersionError(Exception):
     pass
 
+# Kinds of VGM commands in the opcode table
+UNKNOWN = 0         # not defined by the specification, skipped without operands
+COMMAND = 1         # fixed size operands, stored in the command list
+PCM_WRITE = 2       # fixed size operands after the compatibility byte (0x66)
+DATA_BLOCK = 3      # variable size data block
+END = 4             # end of sound data
+
+def build_opcode_table():
+    # 256 entries of (operand size, kind) indexed by the opcode. Operand
+    # sizes follow the reserved ranges of the specification, which also
+    # covers the commands for the second chip in dual chip VGMs
+    table = [(0, UNKNOWN)] * 256
+    def define(opcodes, size, kind=COMMAND):
+        for opcode in opcodes:
+            table[opcode] = (size, kind)
+
+    # 0x30..0x3F dd - one operand, reserved for the second chip:
+    #                 0x30 is a second SN76489, 0x3F a second Game Gear PSG stereo
+    # 0x31 dd - AY8910 stereo mask, dd is a bit mask of i y r3 l3 r2 l2 r1 l1 (bit 7 ... 0)
+    #           i   chip instance (0 or 1)
+    #           y   set stereo mask for YM2203 SSG (1) or AY8910 (0)
+    #           l1/l2/l3    enable channel 1/2/3 on left speaker
+    #           r1/r2/r3    enable channel 1/2/3 on right speaker
+    define(range(0x30, 0x40), 1)
+    # 0x40..0x4E dd dd - two operands, reserved
+    define(range(0x40, 0x4f), 2)
+    # 0x4f dd - Game Gear PSG stereo, write dd to port 0x06
+    # 0x50 dd - PSG (SN76489/SN76496) write value dd
+    define([0x4f, 0x50], 1)
+    # 0x51 aa dd - YM2413, write value dd to register aa
+    # 0x52 aa dd - YM2612 port 0, write value dd to register aa
+    # 0x53 aa dd - YM2612 port 1, write value dd to register aa
+    # 0x54 aa dd - YM2151, write value dd to register aa
+    # 0x55 aa dd - YM2203, write value dd to register aa
+    # 0x56 aa dd - YM2608 port 0, write value dd to register aa
+    # 0x57 aa dd - YM2608 port 1, write value dd to register aa
+    # 0x58 aa dd - YM2610 port 0, write value dd to register aa
+    # 0x59 aa dd - YM2610 port 1, write value dd to register aa
+    # 0x5A aa dd - YM3812, write value dd to register aa
+    # 0x5B aa dd - YM3526, write value dd to register aa
+    # 0x5C aa dd - Y8950, write value dd to register aa
+    # 0x5D aa dd - YMZ280B, write value dd to register aa
+    # 0x5E aa dd - YMF262 port 0, write value dd to register aa
+    # 0x5F aa dd - YMF262 port 1, write value dd to register aa
+    define(range(0x51, 0x60), 2)
+    # 0x61 nn nn - Wait n samples, n can range from 0 to 65535
+    define([0x61], 2)
+    # 0x62 - Wait 735 samples (60th of a second)
+    # 0x63 - Wait 882 samples (50th of a second)
+    define([0x62, 0x63], 0)
+    # 0x66 - End of sound data
+    define([0x66], 0, END)
+    # 0x67 0x66 tt ss ss ss ss - Data block
+    define([0x67], 6, DATA_BLOCK)
+    # 0x68 0x66 cc oo oo oo dd dd dd ss ss ss - PCM RAM write
+    define([0x68], 11, PCM_WRITE)
+    # 0x7n - Wait n+1 samples, n can range from 0 to 15
+    # 0x8n - YM2612 port 0 address 2A write from the data bank, then
+    #        wait n samples; n can range from 0 to 15
+    define(range(0x70, 0x90), 0)
+    # 0x90 ss tt pp cc - DAC Setup Stream Control
+    # 0x91 ss dd ll bb - DAC Set Stream Data
+    # 0x92 ss ff ff ff ff - DAC Set Stream Frequency
+    # 0x93 ss aa aa aa aa mm ll ll ll ll - DAC Start Stream
+    # 0x94 ss - DAC Stop Stream
+    # 0x95 ss bb bb ff - DAC Start Stream (fast call)
+    define([0x90, 0x91, 0x95], 4)
+    define([0x92], 5)
+    define([0x93], 10)
+    define([0x94], 1)
+    # 0xA0 aa dd - AY8910, write value dd to register aa
+    # 0xA1..0xAF aa dd - second chip for the commands 0x51..0x5F
+    # 0xB0 aa dd - RF5C68, write value dd to register aa
+    # 0xB1 aa dd - RF5C164, write value dd to register aa
+    # 0xB2 ad dd - PWM, write value ddd to register a (d is MSB, dd is LSB)
+    # 0xB3 aa dd - GameBoy DMG, write value dd to register aa
+    # 0xB4 aa dd - NES APU, write value dd to register aa
+    # 0xB5 aa dd - MultiPCM, write value dd to register aa
+    # 0xB6 aa dd - uPD7759, write value dd to register aa
+    # 0xB7 aa dd - OKIM6258, write value dd to register aa
+    # 0xB8 aa dd - OKIM6295, write value dd to register aa
+    # 0xB9 aa dd - HuC6280, write value dd to register aa
+    # 0xBA aa dd - K053260, write value dd to register aa
+    # 0xBB aa dd - Pokey, write value dd to register aa
+    # 0xBC aa dd - WonderSwan, write value dd to register aa
+    # 0xBD aa dd - SAA1099, write value dd to register aa
+    # 0xBE aa dd - ES5506, write value dd to register aa
+    # 0xBF aa dd - GA20, write value dd to register aa
+    define(range(0xa0, 0xc0), 2)
+    # 0xC0 bbaa dd - Sega PCM, write value dd to memory offset aabb
+    # 0xC1 bbaa dd - RF5C68, write value dd to memory offset aabb
+    # 0xC2 bbaa dd - RF5C164, write value dd to memory offset aabb
+    # 0xC3 cc bbaa - MultiPCM, write set bank offset aabb to channel cc
+    # 0xC4 mmll rr - QSound, write value mmll to register rr (mm - data MSB, ll - data LSB)
+    # 0xC5 mmll dd - SCSP, write value dd to memory offset mmll (mm - offset MSB, ll - offset LSB)
+    # 0xC6 mmll dd - WonderSwan, write value dd to memory offset mmll (mm - offset MSB, ll - offset LSB)
+    # 0xC7 mmll dd - VSU, write value dd to memory offset mmll (mm - offset MSB, ll - offset LSB)
+    # 0xC8 mmll dd - X1-010, write value dd to memory offset mmll (mm - offset MSB, ll - offset LSB)
+    # 0xC9..0xCF dd dd dd - three operands, reserved
+    # 0xD0 pp aa dd - YMF278B, port pp, write value dd to register aa
+    # 0xD1 pp aa dd - YMF271, port pp, write value dd to register aa
+    # 0xD2 pp aa dd - SCC1, port pp, write value dd to register aa
+    # 0xD3 pp aa dd - K054539, write value dd to register ppaa
+    # 0xD4 pp aa dd - C140, write value dd to register ppaa
+    # 0xD5 pp aa dd - ES5503, write value dd to register ppaa
+    # 0xD6 pp aa dd - ES5506, write value aadd to register pp
+    # 0xD7..0xDF dd dd dd - three operands, reserved
+    define(range(0xc0, 0xe0), 3)
+    # 0xE0 dddddddd - Seek to offset dddddddd (Intel byte order) in PCM
+    #                 data bank
+    # 0xE1 mmll aadd - C352, write value aadd to register mmll
+    # 0xE2..0xFF dd dd dd dd - four operands, reserved
+    define(range(0xe0, 0x100), 4)
+    return table
+
+def build_wait_table():
+    # Number of samples to wait after the command, 0x61 takes it from the operand
+    table = [0] * 256
+    table[0x62] = 735
+    table[0x63] = 882
+    for n in range(16):
+        table[0x70 + n] = n + 1
+        table[0x80 + n] = n
+    return table
+
 #
 # VGM Specification: https://vgmrips.net/wiki/VGM_Specification
 #
@@ -375,14 +497,41 @@ class Parser:
         },
     }
 
-    def __init__(self, vgm_data):
-        # Store the VGM data and validate it
-        self.data = ByteBuffer(vgm_data)
+    # Operand sizes and kinds of the commands, and their waits in samples
+    opcode_table = build_opcode_table()
+    wait_table = build_wait_table()
+
+    # Single byte commands as stored in the command list, shared between
+    # all commands to avoid allocating a new bytes object for each of them
+    command_bytes = [bytes([command]) for command in range(256)]
+
+    def __init__(self, vgm_data, lazy=False):
+        # Store the VGM data and validate it. VGM data can be a path to the
+        # file, which is memory mapped until close(), or any bytes-like
+        # object (bytes, bytearray, mmap, memoryview). Data blocks and the
+        # command table are zero-copy views of the data, short command
+        # payloads are bytes
+        self.file = None
+        if isinstance(vgm_data, (str, os.PathLike)):
+            with open(vgm_data, mode='rb') as f:
+                self.file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            vgm_data = self.file
+        self.data = memoryview(vgm_data)
         self.validate_vgm_data()
 
+        # Short operands are sliced from bytes or mmap, which returns small
+        # bytes objects, much cheaper than a memoryview for every command.
+        # Other data is not copied, its slices are turned into bytes instead
+        source = self.data.obj
+        if isinstance(source, (bytes, mmap.mmap)) and len(source) == self.data.nbytes:
+            self.operands = source
+        else:
+            self.operands = self.data.cast('B')
+
         # Set up the variables that will be populated
         self.vgm_data_offset = 0x40
         self.command_list = []
+        self.command_table = None
         self.data_block = None
         self.data_block_type = None
         self.gd3_data = {}
@@ -393,257 +542,202 @@ class Parser:
         self.validate_vgm_version()
 
         # Parse GD3 data and the VGM commands
+        # In the lazy mode "command_list" stays empty and commands are
+        # decoded on demand with iter_commands()
         self.parse_gd3()
-        self.parse_commands()
+        if not lazy:
+            self.parse_commands()
+
+    def close(self):
+        # Unmap the file opened by the parser. Data blocks and command
+        # tables still referenced elsewhere keep the mapping alive until
+        # they are released
+        if self.file is None:
+            return
+        self.command_table = None
+        self.data_block = None
+        try:
+            self.data.release()
+            self.file.close()
+        except BufferError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     def parse_commands(self):
-        # Save the current position of the VGM data
-        original_pos = self.data.tell()
-
-        # Seek to the start of the VGM data
-        self.data.seek(
-            self.vgm_data_offset
-            #self.metadata['vgm_data_offset'] +
-            #self.metadata_offsets[self.metadata['version']]['vgm_data_offset']['offset']
-        )
+        self.command_list = list(self.iter_commands())
+
+    def parse_command_table(self):
+        # Build a columnar table of the VGM commands in a single pass. Instead
+        # of a dict per command, the table keeps parallel arrays of opcodes,
+        # offsets and lengths of the payloads and the absolute sample time
+        # at which each command is executed. Payloads are not copied, the
+        # offsets point into "buffer" which holds the uncompressed VGM data.
+        # Rows match the entries of "command_list" one to one. The buffer is
+        # a view of its own, thus the table stays valid after close()
+        buffer = self.data[:]
+
+        opcodes = array('B')
+        offsets = array('I')
+        lengths = array('I')
+        samples = array('Q')
+        opcode_table = self.opcode_table
+        wait_table = self.wait_table
+
+        pos = self.vgm_data_offset
+        sample = 0
+        while pos < len(buffer):
+            command = buffer[pos]
+            pos += 1
+            size, kind = opcode_table[command]
+
+            if kind == UNKNOWN:
+                continue
+
+            # Data blocks are not part of the table
+            if kind == DATA_BLOCK:
+                pos += size + struct.unpack_from('<I', buffer, pos + 2)[0]
+                continue
+
+            # Skip the compatibility byte (0x66) of PCM RAM write
+            if kind == PCM_WRITE:
+                pos += 1
+                size -= 1
+
+            opcodes.append(command)
+            offsets.append(pos)
+            lengths.append(size)
+            samples.append(sample)
+
+            # Advance the time by the wait commands
+            if command == 0x61:
+                sample += buffer[pos] | (buffer[pos + 1] << 8)
+            else:
+                sample += wait_table[command]
+
+            pos += size
+            if kind == END:
+                break
+
+        self.command_table = {
+            'buffer': buffer,
+            'opcode': opcodes,
+            'offset': offsets,
+            'length': lengths,
+            'sample': samples,
+        }
+        return self.command_table
+
+    def iter_opcodes(self):
+        # Lazily yield the opcode and the wait in samples of every command,
+        # rows match the command table. Payloads are neither decoded nor
+        # sliced, thus the timing of a song is scanned much cheaper than
+        # with parse_command_table() or iter_commands()
+        operands = self.operands
+        opcode_table = self.opcode_table
+        wait_table = self.wait_table
+
+        pos = self.vgm_data_offset
+        end = len(operands)
+        while pos < end:
+            command = operands[pos]
+            pos += 1
+            size, kind = opcode_table[command]
+
+            if kind == UNKNOWN:
+                continue
+
+            # Data blocks are not part of the table
+            if kind == DATA_BLOCK:
+                pos += size + struct.unpack_from('<I', operands, pos + 2)[0]
+                continue
+
+            if command == 0x61:
+                yield command, operands[pos] | (operands[pos + 1] << 8)
+            else:
+                yield command, wait_table[command]
 
-        while True:
-            # Read a byte, this will be a VGM command, we will then make
-            # decisions based on the given command
-            command = self.data.read(1)
+            pos += size
+            if kind == END:
+                break
 
-            # Break if we are at the end of the file
-            if command == '':
+    def iter_commands(self):
+        # Lazily yield VGM commands one at a time, starting at the VGM data
+        # offset. Command payloads are bytes, single byte payloads are shared
+        # from "command_bytes", only data blocks are zero-copy slices of the
+        # VGM data. Operand sizes come from the opcode table, see
+        # build_opcode_table()
+        # @TODO: add optional flag to unpack operands
+        # @TODO: implement extra header (v1.70) support
+        data = self.data
+        operands = self.operands
+        opcode_table = self.opcode_table
+        command_bytes = self.command_bytes
+
+        pos = self.vgm_data_offset
+        end = len(operands)
+        while pos < end:
+            command = operands[pos]
+            pos += 1
+            size, kind = opcode_table[command]
+
+            if kind == COMMAND:
+                if size == 1:
+                    operand = command_bytes[operands[pos]]
+                elif size > 1:
+                    operand = bytes(operands[pos:pos + size])
+                else:
+                    operand = None
+                yield {'command': command_bytes[command], 'data': operand}
+
+            elif kind == PCM_WRITE:
+                # Skip the compatibility byte (0x66) and read the rest of data
+                yield {
+                    'command': command_bytes[command],
+                    'data': bytes(operands[pos + 1:pos + size]),
+                }
+
+            elif kind == DATA_BLOCK:
+                # Skip the compatibility byte (0x66), read the type and the size
+                # of the data block, then store the data block for later use
+                self.data_block_type = data[pos + 1:pos + 2]
+                data_block_size = struct.unpack_from('<I', data, pos + 2)[0]
+                self.data_block = data[pos + size:pos + size + data_block_size]
+                pos += data_block_size
+
+            elif kind == END:
+                # Stop processing commands if we are at the end of the music data
+                yield {'command': command_bytes[command], 'data': None}
                 break
 
-            # @TODO: automatize reading of command operands based on reserved ranges in specification (that should take care of dual chip support as well)
-            # @TODO: add optional flag to unpack operands
-            # @TODO: implement extra header (v1.70) support
-
-            # 0x31 dd - AY8910 stereo mask, dd is a bit mask of i y r3 l3 r2 l2 r1 l1 (bit 7 ... 0)
-            #           i   chip instance (0 or 1)
-            #           y   set stereo mask for YM2203 SSG (1) or AY8910 (0)
-            #           l1/l2/l3    enable channel 1/2/3 on left speaker
-            #           r1/r2/r3    enable channel 1/2/3 on right speaker
-            # 0x4f dd - Game Gear PSG stereo, write dd to port 0x06
-            # 0x50 dd - PSG (SN76489/SN76496) write value dd
-            if command in [b'\x31', b'\x4f', b'\x50']:
-                self.command_list.append({
-                    'command': command,
-                    'data': self.data.read(1),
-                })
-
-            # 0x51 aa dd - YM2413, write value dd to register aa
-            # 0x52 aa dd - YM2612 port 0, write value dd to register aa
-            # 0x53 aa dd - YM2612 port 1, write value dd to register aa
-            # 0x54 aa dd - YM2151, write value dd to register aa
-            # 0x55 aa dd - YM2203, write value dd to register aa
-            # 0x56 aa dd - YM2608 port 0, write value dd to register aa
-            # 0x57 aa dd - YM2608 port 1, write value dd to register aa
-            # 0x58 aa dd - YM2610 port 0, write value dd to register aa
-            # 0x59 aa dd - YM2610 port 1, write value dd to register aa
-            # 0x5A aa dd - YM3812, write value dd to register aa
-            # 0x5B aa dd - YM3526, write value dd to register aa
-            # 0x5C aa dd - Y8950, write value dd to register aa
-            # 0x5D aa dd - YMZ280B, write value dd to register aa
-            # 0x5E aa dd - YMF262 port 0, write value dd to register aa
-            # 0x5F aa dd - YMF262 port 1, write value dd to register aa
-            # 0xA0 aa dd - AY8910, write value dd to register aa
-            # 0xB0 aa dd - RF5C68, write value dd to register aa
-            # 0xB1 aa dd - RF5C164, write value dd to register aa
-            # 0xB2 ad dd - PWM, write value ddd to register a (d is MSB, dd is LSB)
-            # 0xB3 aa dd - GameBoy DMG, write value dd to register aa
-            # 0xB4 aa dd - NES APU, write value dd to register aa
-            # 0xB5 aa dd - MultiPCM, write value dd to register aa
-            # 0xB6 aa dd - uPD7759, write value dd to register aa
-            # 0xB7 aa dd - OKIM6258, write value dd to register aa
-            # 0xB8 aa dd - OKIM6295, write value dd to register aa
-            # 0xB9 aa dd - HuC6280, write value dd to register aa
-            # 0xBA aa dd - K053260, write value dd to register aa
-            # 0xBB aa dd - Pokey, write value dd to register aa
-            # 0xBC aa dd - WonderSwan, write value dd to register aa
-            # 0xBD aa dd - SAA1099, write value dd to register aa
-            # 0xBE aa dd - ES5506, write value dd to register aa
-            # 0xBF aa dd - GA20, write value dd to register aa
-            elif command in [b'\x51', b'\x52', b'\x53', b'\x54',
-                             b'\x55', b'\x56', b'\x57', b'\x58',
-                             b'\x59', b'\x5a', b'\x5b', b'\x5c',
-                             b'\x5d', b'\x5e', b'\x5f', b'\xa0',
-                             b'\xb0', b'\xb1', b'\xb2', b'\xb3',
-                             b'\xb4', b'\xb5', b'\xb6', b'\xb7',
-                             b'\xb8', b'\xb9', b'\xba', b'\xbb',
-                             b'\xbc', b'\xbd', b'\xbe', b'\xbf',
-                            ]:
-                self.command_list.append({
-                    'command': command,
-                    'data': self.data.read(2),
-                })
-
-            # 0x61 nn nn - Wait n samples, n can range from 0 to 65535
-            elif command == b'\x61':
-                self.command_list.append({
-                    'command': command,
-                    'data': self.data.read(2), # struct.unpack('<H', self.data.read(2))[0],
-                })
-
-            # 0x62 - Wait 735 samples (60th of a second)
-            # 0x63 - Wait 882 samples (50th of a second)
-            # 0x66 - End of sound data
-            elif command in [b'\x62', b'\x63', b'\x66']:
-                self.command_list.append({'command': command, 'data': None})
-
-                # Stop processing commands if we are at the end of the music
-                # data
-                if command == b'\x66':
-                    break
-
-            # 0x67 0x66 tt ss ss ss ss - Data block
-            elif command == b'\x67':
-                # Skip the compatibility byte (0x66)
-                self.data.seek(1, 1)
-
-                self.data_block_type = self.data.read(1)
-
-                # Read the size of the data block
-                data_block_size = struct.unpack('<I', self.data.read(4))[0]
-
-                # Store the data block for later use
-                self.data_block = ByteBuffer(self.data.read(data_block_size))
-
-            # 0x68 0x66 cc oo oo oo dd dd dd ss ss ss - PCM RAM write
-            elif command == b'\x68':
-                # Skip the compatibility byte (0x66)
-                self.data.seek(1, 1)
-                # Read the rest of data cc oo oo oo dd dd dd ss ss ss
-                self.command_list.append({
-                    'command': command,
-                    'data': self.data.read(10),
-                })
-
-            # 0x7n - Wait n+1 samples, n can range from 0 to 15
-            # 0x8n - YM2612 port 0 address 2A write from the data bank, then
-            #        wait n samples; n can range from 0 to 15
-            elif b'\x70' <= command <= b'\x8f':
-                self.command_list.append({'command': command, 'data': None})
-
-            # 0x90 ss tt pp cc - DAC Setup Stream Control
-            elif command == b'\x90':
-                self.command_list.append({
-                    'command': command,
-                    'data': self.data.read(4),
-                })
-            # 0x91 ss dd ll bb - DAC Set Stream Data
-            elif command == b'\x91':
-                self.command_list.append({
-                    'command': command,
-                    'data': self.data.read(4),
-                })
-            # 0x92 ss ff ff ff ff - DAC Set Stream Frequency
-            elif command == b'\x92':
-                self.command_list.append({
-                    'command': command,
-                    'data': self.data.read(5),
-                })
-            # 0x93 ss aa aa aa aa mm ll ll ll ll - DAC Start Stream
-            elif command == b'\x93':
-                self.command_list.append({
-                    'command': command,
-                    'data': self.data.read(10),
-                })
-            # 0x94 ss - DAC Stop Stream
-            elif command == b'\x94':
-                self.command_list.append({
-                    'command': command,
-                    'data': self.data.read(1),
-                })
-            # 0x95 ss bb bb ff - DAC Start Stream (fast call)
-            elif command == b'\x95':
-                self.command_list.append({
-                    'command': command,
-                    'data': self.data.read(4),
-                })
-
-            # 0xC0 bbaa dd - Sega PCM, write value dd to memory offset aabb
-            # 0xC1 bbaa dd - RF5C68, write value dd to memory offset aabb
-            # 0xC2 bbaa dd - RF5C164, write value dd to memory offset aabb
-            # 0xC3 cc bbaa - MultiPCM, write set bank offset aabb to channel cc
-            # 0xC4 mmll rr - QSound, write value mmll to register rr (mm - data MSB, ll - data LSB)
-            # 0xC5 mmll dd - SCSP, write value dd to memory offset mmll (mm - offset MSB, ll - offset LSB)
-            # 0xC6 mmll dd - WonderSwan, write value dd to memory offset mmll (mm - offset MSB, ll - offset LSB)
-            # 0xC7 mmll dd - VSU, write value dd to memory offset mmll (mm - offset MSB, ll - offset LSB)
-            # 0xC8 mmll dd - X1-010, write value dd to memory offset mmll (mm - offset MSB, ll - offset LSB)
-            # 0xD0 pp aa dd - YMF278B, port pp, write value dd to register aa
-            # 0xD1 pp aa dd - YMF271, port pp, write value dd to register aa
-            # 0xD2 pp aa dd - SCC1, port pp, write value dd to register aa
-            # 0xD3 pp aa dd - K054539, write value dd to register ppaa
-            # 0xD4 pp aa dd - C140, write value dd to register ppaa
-            # 0xD5 pp aa dd - ES5503, write value dd to register ppaa
-            # 0xD6 pp aa dd - ES5506, write value aadd to register pp
-            elif command in [b'\xc0', b'\xc1', b'\xc2', b'\xc3',
-                             b'\xc4', b'\xc5', b'\xc6', b'\xc7',
-                             b'\xc8',
-                             b'\xd0', b'\xd1', b'\xd2', b'\xd3',
-                             b'\xd4', b'\xd5', b'\xd6',
-                            ]:
-                self.command_list.append({
-                    'command': command,
-                    'data': self.data.read(3),
-                })
-
-            # 0xE0 dddddddd - Seek to offset dddddddd (Intel byte order) in PCM
-            #                 data bank
-            elif command == b'\xe0':
-                self.command_list.append({
-                    'command': command,
-                    'data': self.data.read(4),
-                })
-
-            # 0xE1 mmll aadd - C352, write value aadd to register mmll
-            elif command == b'\xe1':
-                self.command_list.append({
-                    'command': command,
-                    'data': self.data.read(4),
-                })
-
-        # Seek back to the original position in the VGM data
-        self.data.seek(original_pos)
+            pos += size
 
     def parse_gd3(self):
-        # Save the current position of the VGM data
-        original_pos = self.data.tell()
-
-        # Seek to the start of the GD3 data
-        self.data.seek(
+        # Find the start of the GD3 data
+        pos = (
             self.metadata['gd3_offset'] +
             self.metadata_offsets[self.metadata['version']]['gd3_offset']['offset']
         )
 
         # Skip 8 bytes ('Gd3 ' string and 4 byte version identifier)
-        self.data.seek(8, 1)
+        pos += 8
 
-        # Get the length of the GD3 data, then read it
-        gd3_length = struct.unpack('<I', self.data.read(4))[0]
-        gd3_data = ByteBuffer(self.data.read(gd3_length))
+        # Get the length of the GD3 data, then take it
+        gd3_length = struct.unpack_from('<I', self.data, pos)[0]
+        gd3_data = self.data[pos + 4:pos + 4 + gd3_length]
 
-        # Parse the GD3 data
+        # Parse the GD3 data. All characters (English and Japanese) in the
+        # GD3 data use two byte encoding, fields are terminated by 0x0000
         gd3_fields = []
-        current_field = b''
-        while True:
-            # Read two bytes. All characters (English and Japanese) in the GD3
-            # data use two byte encoding
-            char = gd3_data.read(2)
-
-            # Break if we are at the end of the GD3 data
-            if char == b'':
-                break
-
-            # Check if we are at the end of a field, if not then continue to
-            # append to "current_field"
-            if char == b'\x00\x00':
-                gd3_fields.append(current_field)
-                current_field = b''
-            else:
-                current_field += char
+        field_start = 0
+        for char in range(0, len(gd3_data) - 1, 2):
+            if gd3_data[char] == 0 and gd3_data[char + 1] == 0:
+                gd3_fields.append(bytes(gd3_data[field_start:char]))
+                field_start = char + 2
 
         # Once all the fields have been parsed, create a dict with the data
         self.gd3_data = {
@@ -660,13 +754,7 @@ class Parser:
             'notes': gd3_fields[10],
         }
 
-        # Seek back to the original position in the VGM data
-        self.data.seek(original_pos)
-
     def parse_metadata(self):
-        # Save the current position of the VGM data
-        original_pos = self.data.tell()
-
         # Create the list to store the VGM metadata
         self.metadata = {}
 
@@ -699,16 +787,15 @@ class Parser:
                         self.metadata[value] = 0
                         continue
 
-                    # Seek to the data location and read the data
-                    self.data.seek(offset_data['offset'])
-                    data = self.data.read(offset_data['size'])
-
-                    # Unpack the data if required
+                    # Unpack the data at its location if required
                     if offset_data['type_format'] is not None:
-                        data = struct.unpack(
+                        data = struct.unpack_from(
                             offset_data['type_format'],
-                            data,
+                            self.data,
+                            offset_data['offset'],
                         )[0]
+                    else:
+                        data = bytes(self.data[offset_data['offset']:offset_data['offset'] + offset_data['size']])
 
                     # Check if special condition applies
                     # mostly used for a backwards compatibility handling in pre 1.10 formats
@@ -717,33 +804,20 @@ class Parser:
 
                     self.metadata[value] = data
 
-        # Seek back to the original position in the VGM data
-        self.data.seek(original_pos)
-
     def validate_vgm_data(self):
-        # Save the current position of the VGM data
-        original_pos = self.data.tell()
-
-        # Seek to the start of the file
-        self.data.seek(0)
-
         # Perform basic validation on the given file by checking for the VGM
         # magic number ('Vgm ')
-        if self.data.read(4) != self.vgm_magic_number:
+        if self.data[0:4] != self.vgm_magic_number:
             # Could not find the magic number. The file could be gzipped (e.g.
             # a vgz file). Try un-gzipping the file and trying again.
-            self.data.seek(0)
-            self.data = gzip.GzipFile(fileobj=self.data, mode='rb')
-
             try:
-                if self.data.read(4) != self.vgm_magic_number:
-                    raise ValueError('Data does not appear to be a valid VGM file')
-            except IOError:
+                self.data = memoryview(gzip.decompress(self.data))
+            except (IOError, EOFError):
                 # IOError will be raised if the file is not a valid gzip file
                 raise ValueError('Data does not appear to be a valid VGM file')
 
-        # Seek back to the original position in the VGM data
-        self.data.seek(original_pos)
+            if self.data[0:4] != self.vgm_magic_number:
+                raise ValueError('Data does not appear to be a valid VGM file')
 
     def validate_vgm_version(self):
         def bcd_version_to_str(bcd):
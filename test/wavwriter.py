@@ -0,0 +1,54 @@
+# Streaming writer of 16-bit mono PCM WAV files.
+#
+# Samples are appended chunk by chunk and the RIFF header sizes are patched on every flush(),
+# thus the cost of writing is linear in the length of the recording
+# and the file stays valid even if the simulation is killed midway.
+#
+#   wav = WavWriter("../output/song.master.wav", 44100)
+#   wav.write(np.int16(chunk))
+#   wav.flush()
+#   wav.close()
+
+import struct
+import numpy as np
+
+class WavWriter:
+    HEADER_SIZE = 44
+
+    def __init__(self, filename, sampling_rate, channels=1):
+        self.filename = filename
+        self.sampling_rate = sampling_rate
+        self.channels = channels
+        self.data_size = 0
+        self.file = open(filename, mode="wb")
+        self.file.write(self.header())
+
+    def header(self):
+        bytes_per_sample = 2 * self.channels
+        return b'RIFF' + struct.pack('<I', self.HEADER_SIZE - 8 + self.data_size) + b'WAVE' + \
+               b'fmt ' + struct.pack('<IHHIIHH', 16, 1, self.channels, self.sampling_rate,
+                                     self.sampling_rate * bytes_per_sample, bytes_per_sample, 16) + \
+               b'data' + struct.pack('<I', self.data_size)
+
+    def write(self, samples):
+        data = np.asarray(samples, dtype='<i2').tobytes()
+        self.file.write(data)
+        self.data_size += len(data)
+
+    def flush(self):
+        # patch RIFF and data chunk sizes, then continue appending at the end of the file
+        self.file.seek(0)
+        self.file.write(self.header())
+        self.file.seek(0, 2)
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()